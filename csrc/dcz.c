@@ -26,30 +26,92 @@ typedef struct _dcz_entry {
     uint16_t is_encrypted;  //flag for actual encryption
 } DCZEntry;
 
-uint32_t _fletcher32(uint8_t *buf, uint32_t len){
-    uint16_t sum1 = 0;
-    uint16_t sum2 = 0;
-    uint16_t e=0;
-    int i,sz;
-    sz=len;
-    if(len%2!=0) sz = len-1;  //account for odd bytes len
-
-    for(i=0;i<sz;i+=2){
-        e = buf[i]|(buf[i+1]<<8);
-        sum1 = (sum1+e)%0xffff;
-        sum2 = (sum1+sum2)%0xffff;
-        // printf("%i] %i %i e %x sum1 %x sum2 %x\n",i,buf[i],buf[i+1],e,sum1,sum2);
+//sums are reduced modulo 0xffff once every FLETCHER_BLOCK words instead of at each word:
+//359 is the largest number of words that can be accumulated in 32 bits
+//starting from reduced sums without overflowing. The result is the same as reducing at each step.
+#define FLETCHER_BLOCK 359
+
+//add words (little endian pairs of bytes) to the running sums
+void _fletcher32_words(uint32_t *s1, uint32_t *s2, uint8_t *buf, uint32_t words){
+    uint32_t sum1 = *s1;
+    uint32_t sum2 = *s2;
+    uint32_t blk;
+
+    while(words){
+        blk = (words>FLETCHER_BLOCK) ? FLETCHER_BLOCK:words;
+        words-=blk;
+        do {
+            sum1 += buf[0]|(buf[1]<<8);
+            sum2 += sum1;
+            buf+=2;
+        } while(--blk);
+        sum1 %= 0xffff;
+        sum2 %= 0xffff;
     }
+    *s1 = sum1;
+    *s2 = sum2;
+}
 
-    if(sz!=len) {
+uint32_t _fletcher32(uint8_t *buf, uint32_t len){
+    uint32_t sum1 = 0;
+    uint32_t sum2 = 0;
+
+    _fletcher32_words(&sum1,&sum2,buf,len/2);
+
+    if(len&1) {
         //add last byte
-        sum1 = (sum1 + buf[sz])%0xffff;
+        sum1 = (sum1 + buf[len-1])%0xffff;
         sum2 = (sum1+sum2)%0xffff;
-        // printf("%i] e %x sum1 %x sum2 %x\n",i,buf[sz],sum1,sum2);
     }
     return (sum2<<16)|sum1;
 }
 
+//state of an incremental checksum, stored in a bytearray owned by the Python side
+typedef struct _fletcher_state {
+    uint16_t sum1;
+    uint16_t sum2;
+    uint8_t odd;        //1 if a byte is waiting for its pair
+    uint8_t last;       //the waiting byte
+    uint16_t unused;
+} FletcherState;
+
+PList *_dcz_header_list(DCZHeader *dch){
+    PList *tpl = plist_new(5,NULL);
+    PLIST_SET_ITEM(tpl,0,pinteger_new(dch->size));
+    PLIST_SET_ITEM(tpl,1,pinteger_new(dch->version));
+    PLIST_SET_ITEM(tpl,2,pinteger_new(dch->entries));
+    PLIST_SET_ITEM(tpl,3,pinteger_new(dch->chksum));
+    PLIST_SET_ITEM(tpl,4,pinteger_new(dch->cardinality));
+    return tpl;
+}
+
+//convert an entry to a list of at least 7 elements (name, addresses, size, format, checksum, encryption, is_encrypted)
+PList *_dcz_entry_list(DCZEntry *dce, int elements){
+    int i,sz=0;
+    PList *tpl = plist_new(elements,NULL);
+    for(i=0;i<16;i++){
+        if(dce->tag[i]==0) break;
+        sz++;
+    }
+    PList *addrs = plist_new(8,NULL);
+    for(i=0;i<8;i++){
+        PLIST_SET_ITEM(addrs,i,pinteger_new(dce->addr[i]));
+    }
+    PLIST_SET_ITEM(tpl,0,pstring_new(sz,dce->tag));
+    PLIST_SET_ITEM(tpl,1,addrs);
+    PLIST_SET_ITEM(tpl,2,pinteger_new(dce->size));
+    sz=0;
+    for(i=0;i<4;i++){
+        if(dce->format[i]==0) break;
+        sz++;
+    }
+    PLIST_SET_ITEM(tpl,3,pstring_new(sz,dce->format));
+    PLIST_SET_ITEM(tpl,4,pinteger_new(dce->chksum));
+    PLIST_SET_ITEM(tpl,5,pinteger_new(dce->encrypted));
+    PLIST_SET_ITEM(tpl,6,pinteger_new(dce->is_encrypted));
+    return tpl;
+}
+
 C_NATIVE(_dcz_decode_header)
 {
     NATIVE_UNWARN();
@@ -63,14 +125,7 @@ C_NATIVE(_dcz_decode_header)
     DCZHeader dch;
     memcpy(&dch,buf,sizeof(DCZHeader));
 
-    PList *tpl = plist_new(5,NULL);
-    PLIST_SET_ITEM(tpl,0,pinteger_new(dch.size));
-    PLIST_SET_ITEM(tpl,1,pinteger_new(dch.version));
-    PLIST_SET_ITEM(tpl,2,pinteger_new(dch.entries));
-    PLIST_SET_ITEM(tpl,3,pinteger_new(dch.chksum));
-    PLIST_SET_ITEM(tpl,4,pinteger_new(dch.cardinality));
-
-    *res = tpl;
+    *res = _dcz_header_list(&dch);
     return ERR_OK;
 }
 C_NATIVE(_dcz_encode_header)
@@ -103,7 +158,6 @@ C_NATIVE(_dcz_decode_entry)
     NATIVE_UNWARN();
     uint8_t *buf;
     uint32_t len;
-    int i,sz=0;
     *res = MAKE_NONE();
     if (parse_py_args("s", nargs, args, &buf, &len) != 1) {
         return ERR_TYPE_EXC;
@@ -112,32 +166,83 @@ C_NATIVE(_dcz_decode_entry)
     DCZEntry dce;
     memcpy(&dce,buf,sizeof(DCZEntry));
 
-    PList *tpl = plist_new(7,NULL);
-    for(i=0;i<16;i++){
-        if(dce.tag[i]==0) break;
-        sz++;
-    }
-    PList *addrs = plist_new(8,NULL);
-    for(i=0;i<8;i++){
-        PLIST_SET_ITEM(addrs,i,pinteger_new(dce.addr[i]));
+    *res = _dcz_entry_list(&dce,7);
+    return ERR_OK;
+}
+
+//decode a whole dcz (header followed by all the entries) in a single call
+//returns [header, checksum of the table, [entry0, entry1, ...]]
+//each entry is completed with its index and the dcz index, like DCZ.get_entry does
+C_NATIVE(_dcz_decode_table)
+{
+    NATIVE_UNWARN();
+    uint8_t *buf;
+    uint32_t len;
+    uint32_t version;
+    int i,entries;
+    *res = MAKE_NONE();
+    if (parse_py_args("si", nargs, args, &buf, &len, &version) != 2) {
+        return ERR_TYPE_EXC;
     }
-    PLIST_SET_ITEM(tpl,0,pstring_new(sz,dce.tag));
-    PLIST_SET_ITEM(tpl,1,addrs);
-    PLIST_SET_ITEM(tpl,2,pinteger_new(dce.size));
-    sz=0;
-    for(i=0;i<4;i++){
-        if(dce.format[i]==0) break;
-        sz++;
+    if (len<sizeof(DCZHeader)) return ERR_VALUE_EXC;
+
+    DCZHeader dch;
+    DCZEntry dce;
+    memcpy(&dch,buf,sizeof(DCZHeader));
+    entries = dch.entries;
+    if (sizeof(DCZHeader)+entries*sizeof(DCZEntry)>len) return ERR_VALUE_EXC;
+
+    PList *tpl = plist_new(3,NULL);
+    PList *tbl = plist_new(entries,NULL);
+    PLIST_SET_ITEM(tpl,0,_dcz_header_list(&dch));
+    PLIST_SET_ITEM(tpl,1,pinteger_new(_fletcher32(buf+4,len-4)));
+    for(i=0;i<entries;i++){
+        memcpy(&dce,buf+sizeof(DCZHeader)+i*sizeof(DCZEntry),sizeof(DCZEntry));
+        PList *ee = _dcz_entry_list(&dce,9);
+        PLIST_SET_ITEM(ee,7,pinteger_new(i));
+        PLIST_SET_ITEM(ee,8,pinteger_new(version));
+        PLIST_SET_ITEM(tbl,i,ee);
     }
-    PLIST_SET_ITEM(tpl,3,pstring_new(sz,dce.format));
-    PLIST_SET_ITEM(tpl,4,pinteger_new(dce.chksum));
-    PLIST_SET_ITEM(tpl,5,pinteger_new(dce.encrypted));
-    PLIST_SET_ITEM(tpl,6,pinteger_new(dce.is_encrypted));
+    PLIST_SET_ITEM(tpl,2,tbl);
 
     *res = tpl;
     return ERR_OK;
 }
 
+//search a whole dcz (header followed by all the entries) for the entry named as the given resource
+//returns the entry index or -1 without decoding any entry
+C_NATIVE(_dcz_find_entry)
+{
+    NATIVE_UNWARN();
+    uint8_t *buf;
+    uint32_t len;
+    uint8_t *name;
+    uint32_t nlen;
+    int i,entries;
+    DCZEntry *dce;
+    *res = MAKE_NONE();
+    if (parse_py_args("ss", nargs, args, &buf, &len, &name, &nlen) != 2) {
+        return ERR_TYPE_EXC;
+    }
+    if (len<sizeof(DCZHeader)) return ERR_VALUE_EXC;
+
+    DCZHeader dch;
+    memcpy(&dch,buf,sizeof(DCZHeader));
+    entries = dch.entries;
+    if (sizeof(DCZHeader)+entries*sizeof(DCZEntry)>len) entries = (len-sizeof(DCZHeader))/sizeof(DCZEntry);
+    *res = pinteger_new(-1);
+    if (nlen>16) return ERR_OK;
+
+    for(i=0;i<entries;i++){
+        dce = (DCZEntry*)(buf+sizeof(DCZHeader)+i*sizeof(DCZEntry));
+        if (memcmp(dce->tag,name,nlen)==0 && (nlen==16 || dce->tag[nlen]==0)) {
+            *res = pinteger_new(i);
+            break;
+        }
+    }
+    return ERR_OK;
+}
+
 C_NATIVE(_dcz_encode_entry)
 {
     NATIVE_UNWARN();
@@ -162,6 +267,9 @@ C_NATIVE(_dcz_encode_entry)
 
     //modify dce
     PString *rname = PLIST_ITEM(o,0);
+    if (PSEQUENCE_ELEMENTS(rname)>16) return ERR_VALUE_EXC;
+    //unused bytes must be zero, also when the new value is shorter than the old one
+    memset(dce.tag,0,16);
     memcpy(dce.tag,PSEQUENCE_BYTES(rname),PSEQUENCE_ELEMENTS(rname));
     PList* addrs = PLIST_ITEM(o,1);
     for(i=0;i<8;i++){
@@ -173,9 +281,12 @@ C_NATIVE(_dcz_encode_entry)
     dummy = INTEGER_VALUE(PLIST_ITEM(o,4));
     dce.chksum=dummy;
     rname = PLIST_ITEM(o,3);
+    if (PSEQUENCE_ELEMENTS(rname)>4) return ERR_VALUE_EXC;
+    memset(dce.format,0,4);
     memcpy(dce.format,PSEQUENCE_BYTES(rname),PSEQUENCE_ELEMENTS(rname));
     dummy = INTEGER_VALUE(PLIST_ITEM(o,6));  //is_encrypted
-    if (dce.encrypted && dummy) dce.is_encrypted=1;
+    //the encryption request is set at provisioning and never written: is_encrypted can be set only if requested, and cleared
+    dce.is_encrypted = (dce.encrypted && dummy) ? 1:0;
 
     //write dce
     memcpy(buf+pos,&dce,sizeof(DCZEntry));
@@ -202,3 +313,288 @@ C_NATIVE(_dcz_fletcher32)
     return ERR_OK;
 }
 
+
+C_NATIVE(_dcz_fletcher32_update)
+{
+    NATIVE_UNWARN();
+    uint8_t *state;
+    uint32_t slen;
+    uint8_t *buf;
+    uint32_t len;
+    uint32_t size;
+    uint32_t sum1,sum2;
+    FletcherState fs;
+    *res = MAKE_NONE();
+    if (parse_py_args("ssi", nargs, args, &state, &slen, &buf, &len, &size) != 3) {
+        return ERR_TYPE_EXC;
+    }
+    if (slen<sizeof(FletcherState)) return ERR_VALUE_EXC;
+    if (size<len) len=size;
+
+    memcpy(&fs,state,sizeof(FletcherState));
+    sum1 = fs.sum1;
+    sum2 = fs.sum2;
+    if (fs.odd && len) {
+        //complete the word started by the previous chunk
+        sum1 = (sum1 + (fs.last|(buf[0]<<8)))%0xffff;
+        sum2 = (sum1+sum2)%0xffff;
+        fs.odd = 0;
+        buf++;
+        len--;
+    }
+    _fletcher32_words(&sum1,&sum2,buf,len/2);
+    if (len&1) {
+        fs.odd = 1;
+        fs.last = buf[len-1];
+    }
+    fs.sum1 = sum1;
+    fs.sum2 = sum2;
+    memcpy(state,&fs,sizeof(FletcherState));
+
+    *res = args[0];
+    return ERR_OK;
+}
+
+C_NATIVE(_dcz_fletcher32_digest)
+{
+    NATIVE_UNWARN();
+    uint8_t *state;
+    uint32_t slen;
+    uint32_t sum1,sum2;
+    FletcherState fs;
+    *res = MAKE_NONE();
+    if (parse_py_args("s", nargs, args, &state, &slen) != 1) {
+        return ERR_TYPE_EXC;
+    }
+    if (slen<sizeof(FletcherState)) return ERR_VALUE_EXC;
+
+    memcpy(&fs,state,sizeof(FletcherState));
+    sum1 = fs.sum1;
+    sum2 = fs.sum2;
+    if (fs.odd) {
+        //add last byte
+        sum1 = (sum1 + fs.last)%0xffff;
+        sum2 = (sum1+sum2)%0xffff;
+    }
+
+    *res = pinteger_new((sum2<<16)|sum1);
+    return ERR_OK;
+}
+
+C_NATIVE(_dcz_fletcher32_patch)
+{
+    NATIVE_UNWARN();
+    uint32_t chk;
+    uint32_t size;
+    uint32_t start;
+    uint8_t *old;
+    uint32_t olen;
+    uint8_t *patched;
+    uint32_t nlen;
+    uint32_t sum1,sum2;
+    uint32_t i,n,w,d;
+    *res = MAKE_NONE();
+    if (parse_py_args("iiiss", nargs, args, &chk, &size, &start, &old, &olen, &patched, &nlen) != 5) {
+        return ERR_TYPE_EXC;
+    }
+    //the patched region must start on a word and lie inside the data
+    if ((start&1) || olen!=nlen || start>size || olen>size-start) return ERR_VALUE_EXC;
+    //an odd region can only end with the data
+    if ((olen&1) && start+olen!=size) return ERR_VALUE_EXC;
+
+    //word i of n weights 1 in sum1 and n-i in sum2: just add the difference of the changed words
+    sum1 = chk&0xffff;
+    sum2 = chk>>16;
+    n = (size+1)/2;
+    for(i=0;i<olen;i+=2) {
+        if (i+1<olen) {
+            w = old[i]|(old[i+1]<<8);
+            d = patched[i]|(patched[i+1]<<8);
+        } else {
+            w = old[i];
+            d = patched[i];
+        }
+        if (w==d) continue;
+        d = (d+0xffff-w)%0xffff;
+        w = (n-(start+i)/2)%0xffff;
+        sum1 = (sum1+d)%0xffff;
+        sum2 = (sum2+w*d)%0xffff;
+    }
+
+    *res = pinteger_new((sum2<<16)|sum1);
+    return ERR_OK;
+}
+
+//KV format: a compact encoding of flat dicts of strings and ints
+// - count: uint16_t, the number of items
+// - for each item:
+//   - key length: uint8_t, followed by the key
+//   - type: uint8_t, KV_INT or KV_STR
+//   - value: int32_t for KV_INT, uint16_t length followed by the bytes for KV_STR
+//All numbers are little endian.
+#define KV_INT 0
+#define KV_STR 1
+
+//check the item at pos, return the position of the next item or 0 if malformed
+uint32_t _kv_skip(uint8_t *buf, uint32_t len, uint32_t pos){
+    uint32_t n;
+    if (pos+1>len) return 0;
+    pos += 1+buf[pos];
+    if (pos+1>len) return 0;
+    if (buf[pos]==KV_INT) {
+        pos+=5;
+    } else if (buf[pos]==KV_STR) {
+        if (pos+3>len) return 0;
+        n = buf[pos+1]|(buf[pos+2]<<8);
+        pos+=3+n;
+    } else return 0;
+    if (pos>len) return 0;
+    return pos;
+}
+
+//value of the item at pos, already checked by _kv_skip
+PObject *_kv_value(uint8_t *buf, uint32_t pos){
+    int32_t v;
+    pos += 1+buf[pos];
+    if (buf[pos]==KV_INT) {
+        memcpy(&v,buf+pos+1,4);
+        return pinteger_new(v);
+    }
+    return pstring_new(buf[pos+1]|(buf[pos+2]<<8),buf+pos+3);
+}
+
+//encode the flat list of keys and values in a new bytearray, in a single call
+C_NATIVE(_dcz_kv_encode)
+{
+    NATIVE_UNWARN();
+    PObject *items;
+    uint8_t *buf;
+    uint32_t pos,i,n;
+    int64_t iv;
+    int32_t v;
+    PObject *k;
+    PObject *o;
+    *res = MAKE_NONE();
+    if (nargs!=1) return ERR_TYPE_EXC;
+    items = args[0];
+    if (PTYPE(items)!=PLIST || (PSEQUENCE_ELEMENTS(items)&1)) return ERR_TYPE_EXC;
+    n = PSEQUENCE_ELEMENTS(items)/2;
+    if (n>0xffff) return ERR_VALUE_EXC;
+
+    //check everything and compute the size before allocating
+    pos = 2;
+    for(i=0;i<n;i++) {
+        k = PLIST_ITEM(items,2*i);
+        o = PLIST_ITEM(items,2*i+1);
+        if (PTYPE(k)!=PSTRING) return ERR_TYPE_EXC;
+        if (PSEQUENCE_ELEMENTS(k)>0xff) return ERR_VALUE_EXC;
+        if (PTYPE(o)==PSTRING) {
+            if (PSEQUENCE_ELEMENTS(o)>0xffff) return ERR_VALUE_EXC;
+            pos += 1+PSEQUENCE_ELEMENTS(k)+3+PSEQUENCE_ELEMENTS(o);
+        } else if (PTYPE(o)==PSMALLINT || PTYPE(o)==PINTEGER) {
+            //values are stored in 32 bits
+            iv = INTEGER_VALUE(o);
+            if (iv<INT32_MIN || iv>INT32_MAX) return ERR_VALUE_EXC;
+            pos += 1+PSEQUENCE_ELEMENTS(k)+5;
+        } else return ERR_TYPE_EXC;
+    }
+
+    PObject *out = (PObject*)pbytearray_new(pos,NULL);
+    buf = PSEQUENCE_BYTES(out);
+    buf[0] = n&0xff;
+    buf[1] = n>>8;
+    pos = 2;
+    for(i=0;i<n;i++) {
+        k = PLIST_ITEM(items,2*i);
+        o = PLIST_ITEM(items,2*i+1);
+        buf[pos++] = PSEQUENCE_ELEMENTS(k);
+        memcpy(buf+pos,PSEQUENCE_BYTES(k),PSEQUENCE_ELEMENTS(k));
+        pos += PSEQUENCE_ELEMENTS(k);
+        if (PTYPE(o)==PSTRING) {
+            buf[pos++] = KV_STR;
+            buf[pos++] = PSEQUENCE_ELEMENTS(o)&0xff;
+            buf[pos++] = PSEQUENCE_ELEMENTS(o)>>8;
+            memcpy(buf+pos,PSEQUENCE_BYTES(o),PSEQUENCE_ELEMENTS(o));
+            pos += PSEQUENCE_ELEMENTS(o);
+        } else {
+            buf[pos++] = KV_INT;
+            v = INTEGER_VALUE(o);
+            memcpy(buf+pos,&v,4);
+            pos += 4;
+        }
+    }
+
+    *res = out;
+    return ERR_OK;
+}
+
+//decode buf in a new dict
+C_NATIVE(_dcz_kv_decode)
+{
+    NATIVE_UNWARN();
+    uint8_t *buf;
+    uint32_t len;
+    uint32_t pos,next,i,n;
+    *res = MAKE_NONE();
+    if (parse_py_args("s", nargs, args, &buf, &len) != 1) {
+        return ERR_TYPE_EXC;
+    }
+    if (len<2) return ERR_VALUE_EXC;
+    n = buf[0]|(buf[1]<<8);
+    //check everything before allocating
+    pos = 2;
+    for(i=0;i<n;i++) {
+        pos = _kv_skip(buf,len,pos);
+        if (!pos) return ERR_VALUE_EXC;
+    }
+
+    PDict *dict = pdict_new(n);
+    pos = 2;
+    for(i=0;i<n;i++) {
+        next = _kv_skip(buf,len,pos);
+        pdict_put(dict,(PObject*)pstring_new(buf[pos],buf+pos+1),_kv_value(buf,pos));
+        pos = next;
+    }
+    *res = (PObject*)dict;
+    return ERR_OK;
+}
+
+//search key among the first items (at most count) of buf[start:end], stopping at the first item not entirely in it
+//returns [position after the checked items, number of checked items, value or None]
+//used to look for a key in a whole resource or reading it in chunks
+C_NATIVE(_dcz_kv_scan)
+{
+    NATIVE_UNWARN();
+    uint8_t *buf;
+    uint32_t len;
+    uint32_t start,end;
+    uint8_t *key;
+    uint32_t klen;
+    uint32_t count;
+    uint32_t pos,next,i;
+    PObject *value = MAKE_NONE();
+    *res = MAKE_NONE();
+    if (parse_py_args("siisi", nargs, args, &buf, &len, &start, &end, &key, &klen, &count) != 5) {
+        return ERR_TYPE_EXC;
+    }
+    if (start>end || end>len) return ERR_VALUE_EXC;
+    pos = start;
+    for(i=0;i<count;i++) {
+        next = _kv_skip(buf,end,pos);
+        if (!next) break;
+        if (buf[pos]==klen && memcmp(buf+pos+1,key,klen)==0) {
+            value = _kv_value(buf,pos);
+            pos = next;
+            i++;
+            break;
+        }
+        pos = next;
+    }
+
+    PList *tpl = plist_new(3,NULL);
+    PLIST_SET_ITEM(tpl,0,pinteger_new(pos));
+    PLIST_SET_ITEM(tpl,1,pinteger_new(i));
+    PLIST_SET_ITEM(tpl,2,value);
+    *res = tpl;
+    return ERR_OK;
+}
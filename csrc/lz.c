@@ -0,0 +1,211 @@
+// #define ZERYNTH_PRINTF 1
+#include "zerynth.h"
+
+
+//LZ compressed data is a sequence of tokens, each starting with a control byte c:
+// - c < 0x80: a run of c+1 literal bytes follows
+// - c >= 0x80: a match of ((c>>2)&0x1f)+3 bytes, starting ((c&3)<<8 | next byte)+1 bytes back in the output
+//Matches never reach more than LZ_WINDOW bytes back, so that a decoder needs only the last LZ_WINDOW output bytes.
+#define LZ_WINDOW 1024
+#define LZ_MIN_MATCH 3
+#define LZ_MAX_MATCH 34
+#define LZ_MAX_LITERALS 128
+#define LZ_HASH_BITS 10
+
+//state of a streaming decoder, stored in a bytearray owned by the Python side
+//and followed by the LZ_WINDOW bytes of the circular window
+typedef struct _lz_state {
+    uint32_t total;     //bytes produced so far
+    uint16_t lit;       //literal bytes still to copy
+    uint16_t mlen;      //match bytes still to copy
+    uint16_t moff;      //offset of the pending match
+    uint8_t ctl;        //match control byte waiting for its offset byte
+    uint8_t has_ctl;
+} LZState;
+
+static uint32_t _lz_hash(uint8_t *p){
+    return ((uint32_t)((p[0]<<16)|(p[1]<<8)|p[2])*2654435761u)>>(32-LZ_HASH_BITS);
+}
+
+//emit literals src[from:to] at dst+op, return the new op or -1 if dst is full
+static int32_t _lz_literals(uint8_t *src, uint32_t from, uint32_t to, uint8_t *dst, uint32_t op, uint32_t dstlen){
+    uint32_t n;
+    while(from<to) {
+        n = to-from;
+        if (n>LZ_MAX_LITERALS) n = LZ_MAX_LITERALS;
+        if (op+1+n>dstlen) return -1;
+        dst[op++] = n-1;
+        memcpy(dst+op,src+from,n);
+        op+=n;
+        from+=n;
+    }
+    return op;
+}
+
+C_NATIVE(_lz_compress)
+{
+    NATIVE_UNWARN();
+    uint8_t *src;
+    uint32_t srclen;
+    uint8_t *dst;
+    uint32_t dstlen;
+    int32_t start;
+    uint8_t *work;
+    uint32_t worklen;
+    uint32_t ip,anchor,cand,h,mlen,k,off;
+    int32_t op;
+    *res = MAKE_NONE();
+    if (parse_py_args("ssis", nargs, args, &src, &srclen, &dst, &dstlen, &start, &work, &worklen) != 4) {
+        return ERR_TYPE_EXC;
+    }
+    if (worklen<(sizeof(uint32_t)<<LZ_HASH_BITS) || start<0 || start>dstlen) return ERR_VALUE_EXC;
+
+    //work holds the last position+1 of each hash of 3 bytes, 0 if none
+    memset(work,0,sizeof(uint32_t)<<LZ_HASH_BITS);
+    op = start;
+    ip = 0;
+    anchor = 0;
+    while(ip+LZ_MIN_MATCH<=srclen) {
+        h = _lz_hash(src+ip);
+        memcpy(&cand,work+h*sizeof(uint32_t),sizeof(uint32_t));
+        k = ip+1;
+        memcpy(work+h*sizeof(uint32_t),&k,sizeof(uint32_t));
+        if (!cand || ip-(cand-1)>LZ_WINDOW) {
+            ip++;
+            continue;
+        }
+        cand--;
+        mlen = 0;
+        while(mlen<LZ_MAX_MATCH && ip+mlen<srclen && src[cand+mlen]==src[ip+mlen]) mlen++;
+        if (mlen<LZ_MIN_MATCH) {
+            ip++;
+            continue;
+        }
+        op = _lz_literals(src,anchor,ip,dst,op,dstlen);
+        if (op<0 || op+2>dstlen) goto full;
+        off = ip-cand-1;
+        dst[op++] = 0x80|((mlen-LZ_MIN_MATCH)<<2)|(off>>8);
+        dst[op++] = off&0xff;
+        //remember the positions inside the match too
+        for(k=ip+1;k<ip+mlen && k+LZ_MIN_MATCH<=srclen;k++) {
+            h = _lz_hash(src+k);
+            cand = k+1;
+            memcpy(work+h*sizeof(uint32_t),&cand,sizeof(uint32_t));
+        }
+        ip+=mlen;
+        anchor = ip;
+    }
+    op = _lz_literals(src,anchor,srclen,dst,op,dstlen);
+    if (op<0) goto full;
+    *res = pinteger_new(op);
+    return ERR_OK;
+
+full:
+    //doesn't fit: not worth compressing
+    *res = pinteger_new(-1);
+    return ERR_OK;
+}
+
+C_NATIVE(_lz_decompress)
+{
+    NATIVE_UNWARN();
+    uint8_t *src;
+    uint32_t srclen;
+    int32_t start;
+    uint8_t *dst;
+    uint32_t dstlen;
+    uint32_t ip,op,n,off;
+    uint8_t c;
+    *res = MAKE_NONE();
+    if (parse_py_args("sis", nargs, args, &src, &srclen, &start, &dst, &dstlen) != 3) {
+        return ERR_TYPE_EXC;
+    }
+    if (start<0 || start>srclen) return ERR_VALUE_EXC;
+
+    ip = start;
+    op = 0;
+    while(ip<srclen) {
+        c = src[ip++];
+        if (!(c&0x80)) {
+            n = c+1;
+            if (ip+n>srclen || op+n>dstlen) return ERR_VALUE_EXC;
+            memcpy(dst+op,src+ip,n);
+            ip+=n;
+            op+=n;
+        } else {
+            if (ip>=srclen) return ERR_VALUE_EXC;
+            off = (((c&3)<<8)|src[ip++])+1;
+            n = ((c>>2)&0x1f)+LZ_MIN_MATCH;
+            if (off>op || op+n>dstlen) return ERR_VALUE_EXC;
+            //byte by byte: the match can overlap the bytes it produces
+            while(n--) {
+                dst[op] = dst[op-off];
+                op++;
+            }
+        }
+    }
+    *res = pinteger_new(op);
+    return ERR_OK;
+}
+
+C_NATIVE(_lz_decode)
+{
+    NATIVE_UNWARN();
+    uint8_t *state;
+    uint32_t slen;
+    uint8_t *src;
+    uint32_t srclen;
+    int32_t ip,srcend;
+    uint8_t *dst;
+    uint32_t dstlen;
+    int32_t op;
+    uint8_t *window;
+    uint8_t b;
+    int32_t produced;
+    LZState st;
+    *res = MAKE_NONE();
+    if (parse_py_args("ssiisi", nargs, args, &state, &slen, &src, &srclen, &ip, &srcend, &dst, &dstlen, &op) != 6) {
+        return ERR_TYPE_EXC;
+    }
+    if (slen<sizeof(LZState)+LZ_WINDOW) return ERR_VALUE_EXC;
+    if (ip<0 || srcend<ip || srcend>srclen || op<0 || op>dstlen) return ERR_VALUE_EXC;
+
+    memcpy(&st,state,sizeof(LZState));
+    window = state+sizeof(LZState);
+    produced = op;
+    while(op<dstlen) {
+        if (st.lit) {
+            if (ip>=srcend) break;
+            b = src[ip++];
+            st.lit--;
+        } else if (st.mlen) {
+            b = window[(st.total-st.moff)&(LZ_WINDOW-1)];
+            st.mlen--;
+        } else {
+            if (ip>=srcend) break;
+            b = src[ip++];
+            if (st.has_ctl) {
+                st.moff = (((st.ctl&3)<<8)|b)+1;
+                st.mlen = ((st.ctl>>2)&0x1f)+LZ_MIN_MATCH;
+                st.has_ctl = 0;
+                if (st.moff>st.total) return ERR_VALUE_EXC;
+            } else if (b&0x80) {
+                st.ctl = b;
+                st.has_ctl = 1;
+            } else {
+                st.lit = b+1;
+            }
+            continue;
+        }
+        dst[op++] = b;
+        window[st.total&(LZ_WINDOW-1)] = b;
+        st.total++;
+    }
+    memcpy(state,&st,sizeof(LZState));
+
+    PList *tpl = plist_new(2,NULL);
+    PLIST_SET_ITEM(tpl,0,pinteger_new(ip));
+    PLIST_SET_ITEM(tpl,1,pinteger_new(op-produced));
+    *res = tpl;
+    return ERR_OK;
+}
@@ -98,7 +98,8 @@ the following criteria should be taken into consideration:
 
     """
 
-
+import timers
+import threading
 
 
 @native_c("_dcz_decode_header",[
@@ -117,6 +118,22 @@ def _decode_header(hbuf):
 def _decode_entry(hbuf):
     pass
 
+@native_c("_dcz_decode_table",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _decode_table(hbuf,version):
+    pass
+
+@native_c("_dcz_find_entry",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _find_entry(hbuf,resource):
+    pass
+
 @native_c("_dcz_encode_header",[
     "csrc/dcz.c"
     ],
@@ -141,28 +158,766 @@ def _encode_entry(hbuf,index,entry):
 def fletcher32(buf):
     pass
 
+@native_c("_dcz_fletcher32_update",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _fletcher32_update(state,buf,size):
+    pass
+
+@native_c("_dcz_fletcher32_digest",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _fletcher32_digest(state):
+    pass
+
+@native_c("_dcz_fletcher32_patch",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _fletcher32_patch(chk,size,start,old,new):
+    pass
+
+@native_c("_dcz_kv_encode",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _kv_encode(items):
+    pass
+
+@native_c("_dcz_kv_decode",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _kv_decode(buf):
+    pass
+
+@native_c("_dcz_kv_scan",[
+    "csrc/dcz.c"
+    ],
+    [],
+    [])
+def _kv_scan(buf,start,end,key,count):
+    pass
+
+@native_c("_lz_compress",[
+    "csrc/lz.c"
+    ],
+    [],
+    [])
+def _lz_compress(src,dst,start,work):
+    pass
+
+@native_c("_lz_decompress",[
+    "csrc/lz.c"
+    ],
+    [],
+    [])
+def _lz_decompress(src,start,dst):
+    pass
+
+@native_c("_lz_decode",[
+    "csrc/lz.c"
+    ],
+    [],
+    [])
+def _lz_decode(state,src,start,end,dst,pos):
+    pass
+
 
 HEADER_SIZE = 16
 ENTRY_SIZE = 64
+LOG_HEADER_SIZE = 12
+DELTA_MAGIC = b"DCZD"
+DELTA_HEADER_SIZE = 6
+DELTA_RECORD_SIZE = 33
+LZ_FORMAT = "lz"
+KV_FORMAT = "kv"
+LZ_HEADER_SIZE = 8
+# hash table of the compressor and state of the streaming decoder, as in csrc/lz.c
+LZ_WORK_SIZE = 4096
+LZ_STATE_SIZE = 12+1024
+# chunk used to look for a key in a "kv" resource: holds any item header (at most 1+255+1+2 bytes)
+KV_CHUNK = 512
+
+# the counters returned by DCZ.stats()
+STATS_COUNTERS = ["calls","reads","read_bytes","writes","write_bytes","decodes","encodes","checksum_bytes","encrypts","decrypts","serializer_ms"]
 
 new_exception(DCZChecksumError,Exception)
 new_exception(DCZNoResourceError,Exception)
 new_exception(DCZMissingSerializerError,Exception)
 
+def _put_int(buf,pos,value,size):
+    # little endian, as in csrc/dcz.c
+    for i in range(size):
+        buf[pos+i]=(value>>(8*i))&0xff
+
+def _get_int(buf,pos,size):
+    value = 0
+    for i in range(size):
+        value|=buf[pos+i]<<(8*i)
+    return value
+
+def _get_str(buf,pos,size):
+    # zero padded string
+    n = 0
+    while n<size and buf[pos+n]:
+        n+=1
+    return str(buf[pos:pos+n])
+
+def _put_str(buf,pos,s):
+    buf[pos:pos+len(s)]=s
+
+class RWLock():
+    """
+============
+RWLock class
+============
+
+.. class:: RWLock()
+
+    A readers/writer lock: many threads can hold it for reading at the same time, while only one thread at a time can hold it for writing.
+    A thread waiting to write blocks new readers, so that writers are not starved by a continuous flow of readers. The lock is not reentrant.
+
+    """
+    def __init__(self):
+        self.turnstile = threading.Lock()
+        self.rlock = threading.Lock()
+        self.wlock = threading.Lock()
+        self.readers = 0
+
+    def acquire_read(self):
+        """
+.. method:: acquire_read()
+
+        Acquire the lock for reading.
+
+        """
+        # wait for pending writers
+        self.turnstile.acquire()
+        self.turnstile.release()
+        self.rlock.acquire()
+        self.readers+=1
+        if self.readers==1:
+            # first reader locks out writers
+            self.wlock.acquire()
+        self.rlock.release()
+
+    def release_read(self):
+        """
+.. method:: release_read()
+
+        Release the lock acquired for reading.
+
+        """
+        self.rlock.acquire()
+        self.readers-=1
+        if self.readers==0:
+            # last reader lets writers in
+            self.wlock.release()
+        self.rlock.release()
+
+    def acquire_write(self):
+        """
+.. method:: acquire_write()
+
+        Acquire the lock for writing.
+
+        """
+        self.turnstile.acquire()
+        self.wlock.acquire()
+
+    def release_write(self):
+        """
+.. method:: release_write()
+
+        Release the lock acquired for writing.
+
+        """
+        self.wlock.release()
+        self.turnstile.release()
+
+
+class Flash():
+    """
+===========
+Flash class
+===========
+
+.. class:: Flash()
+
+    The default storage backend of DCZ: data is read from and written to the device flash, encryption and decryption are done by the VM.
+
+    Custom backends can be given to :class:`DCZ` to keep DCZs in other storages: they must provide the same methods of this class.
+
+    The device flash erases the sectors touched by a write, therefore data can't be added to a sector without rewriting it all.
+    Backends that can write to erased bytes without erasing set :samp:`programmable` to :samp:`True` and provide a :samp:`program(addr,data)` method.
+    The size in bytes of the erased sectors is in :samp:`sector` (4096 by default): writers use it to write a whole sector at a time.
+
+    """
+    programmable = False
+    sector = 4096
+
+    def read(self,addr,size,buf):
+        """
+.. method:: read(addr,size,buf)
+
+        Read :samp:`size` bytes starting at :samp:`addr` into the bytearray :samp:`buf` and return :samp:`buf`.
+
+        """
+        return __read_flash(addr,size,buf)
+
+    def write(self,addr,data):
+        """
+.. method:: write(addr,data)
+
+        Write :samp:`data` starting at :samp:`addr`.
+
+        """
+        __write_flash(addr,data)
+
+    def encrypt(self,chksum,buf):
+        """
+.. method:: encrypt(chksum,buf)
+
+        Encrypt :samp:`buf` in place. :samp:`chksum` is the checksum of the plaintext.
+
+        """
+        __vmctrl(3,0,chksum,buf)
+
+    def decrypt(self,chksum,buf):
+        """
+.. method:: decrypt(chksum,buf)
+
+        Decrypt :samp:`buf` in place. :samp:`chksum` is the checksum of the plaintext.
+
+        """
+        __vmctrl(4,0,chksum,buf)
+
+
+class RamFlash(Flash):
+    """
+==============
+RamFlash class
+==============
+
+.. class:: RamFlash(base,size)
+
+    A storage backend keeping :samp:`size` bytes starting at address :samp:`base` in a RAM bytearray, initialized as erased flash (all bytes at 0xff).
+    It is useful to try DCZ layouts and to test applications without touching the device flash. Encryption is still done by the VM.
+    Writes don't erase anything, therefore :class:`RamFlash` is :samp:`programmable`.
+
+    The content can be initialized from a flash dump with :samp:`write(base,dump)`.
+
+    """
+    programmable = True
+
+    def __init__(self,base,size):
+        self.base = base
+        self.mem = bytearray(b"\xff")*size
+
+    def read(self,addr,size,buf):
+        pos = addr-self.base
+        if pos<0 or pos+size>len(self.mem):
+            raise ValueError
+        buf[0:size]=self.mem[pos:pos+size]
+        return buf
+
+    def write(self,addr,data):
+        pos = addr-self.base
+        if pos<0 or pos+len(data)>len(self.mem):
+            raise ValueError
+        self.mem[pos:pos+len(data)]=data
+
+    def program(self,addr,data):
+        self.write(addr,data)
+
+
+class SimFlash(Flash):
+    """
+==============
+SimFlash class
+==============
+
+.. class:: SimFlash(sector=4096,read_cost=0,write_cost=0,erase_cost=0)
+
+    A storage backend simulating a flash memory organized in sectors of :samp:`sector` bytes, to measure the cost of DCZ operations.
+    Only written sectors are kept in RAM, the others read as erased (all bytes at 0xff).
+
+    Like the device flash, every sector touched by a write is erased first: the erase is counted and the content of the sector
+    not involved in the write is lost (reads as erased).
+
+    The simulated flash counts read and write operations, read and written bytes and erased sectors. The cost of the counted operations is
+    :samp:`read_cost` per read byte, plus :samp:`write_cost` per written byte, plus :samp:`erase_cost` per erased sector (use the same time unit for all of them).
+    Encryption is still done by the VM.
+
+    :class:`SimFlash` is :samp:`programmable`: :samp:`program` writes without erasing and, like a NOR flash, can only turn bits from 1 to 0.
+
+    """
+    programmable = True
+
+    def __init__(self,sector=4096,read_cost=0,write_cost=0,erase_cost=0):
+        self.sector = sector
+        self.read_cost = read_cost
+        self.write_cost = write_cost
+        self.erase_cost = erase_cost
+        self.sectors = {}
+        self.reset()
+
+    def reset(self):
+        """
+.. method:: reset()
+
+        Reset all counters.
+
+        """
+        self.reads = 0
+        self.read_bytes = 0
+        self.writes = 0
+        self.write_bytes = 0
+        self.erases = 0
+
+    def cost(self):
+        """
+.. method:: cost()
+
+        Return the total cost of the operations counted since the last :meth:`reset`.
+
+        """
+        return self.read_bytes*self.read_cost+self.write_bytes*self.write_cost+self.erases*self.erase_cost
+
+    def stats(self):
+        """
+.. method:: stats()
+
+        Return a dict with all the counters and the total cost.
+
+        """
+        return {
+            "reads":self.reads,
+            "read_bytes":self.read_bytes,
+            "writes":self.writes,
+            "write_bytes":self.write_bytes,
+            "erases":self.erases,
+            "cost":self.cost()
+        }
+
+    def read(self,addr,size,buf):
+        self.reads+=1
+        self.read_bytes+=size
+        pos = 0
+        while pos<size:
+            sn = (addr+pos)//self.sector
+            off = (addr+pos)%self.sector
+            n = self.sector-off
+            if n>size-pos:
+                n = size-pos
+            if sn in self.sectors:
+                buf[pos:pos+n]=self.sectors[sn][off:off+n]
+            else:
+                for i in range(pos,pos+n):
+                    buf[i]=0xff
+            pos+=n
+        return buf
+
+    def write(self,addr,data):
+        size = len(data)
+        self.writes+=1
+        self.write_bytes+=size
+        pos = 0
+        while pos<size:
+            sn = (addr+pos)//self.sector
+            off = (addr+pos)%self.sector
+            n = self.sector-off
+            if n>size-pos:
+                n = size-pos
+            # erase the whole sector
+            sec = bytearray(b"\xff")*self.sector
+            self.erases+=1
+            sec[off:off+n]=data[pos:pos+n]
+            self.sectors[sn]=sec
+            pos+=n
+
+    def program(self,addr,data):
+        size = len(data)
+        self.writes+=1
+        self.write_bytes+=size
+        pos = 0
+        while pos<size:
+            sn = (addr+pos)//self.sector
+            off = (addr+pos)%self.sector
+            n = self.sector-off
+            if n>size-pos:
+                n = size-pos
+            if sn not in self.sectors:
+                self.sectors[sn]=bytearray(b"\xff")*self.sector
+            sec = self.sectors[sn]
+            for i in range(n):
+                sec[off+i]&=data[pos+i]
+            pos+=n
+
+
+class Fletcher32():
+    """
+================
+Fletcher32 class
+================
+
+.. class:: Fletcher32()
+
+    Create an incremental checksum. Feeding data with :meth:`update` in chunks of any size (odd sizes included)
+    gives the same result of :samp:`fletcher32` called on the whole data, therefore resources can be checksummed
+    without keeping them entirely in memory. ::
+
+        ck = dcz.Fletcher32()
+        ck.update(chunk1)
+        ck.update(chunk2)
+        print(ck.digest()==dcz.fletcher32(chunk1+chunk2))
+
+    """
+    def __init__(self):
+        self.state = bytearray(8)
+
+    def update(self,buf,size=-1):
+        """
+.. method:: update(buf,size=-1)
+
+        Add the first :samp:`size` bytes of :samp:`buf` to the checksum. If :samp:`size` is negative, the whole :samp:`buf` is added.
+        Return the checksum object itself.
+
+        """
+        if size<0:
+            size = len(buf)
+        _fletcher32_update(self.state,buf,size)
+        return self
+
+    def digest(self):
+        """
+.. method:: digest()
+
+        Return the checksum of all the data added so far. More data can be added afterwards.
+
+        """
+        return _fletcher32_digest(self.state)
+
+    def reset(self):
+        """
+.. method:: reset()
+
+        Restart the checksum from scratch.
+
+        """
+        self.state = bytearray(8)
+
+
+class DCZReader():
+    """
+===============
+DCZReader class
+===============
+
+.. class:: DCZReader(dcz,entry,check=False,chunk=256)
+
+    A reader for the resource identified by :samp:`entry` (see :meth:`DCZ.get_entry`). Readers are usually obtained by calling :meth:`DCZ.open_resource`.
+
+    Resources can be read in chunks into a single reusable buffer: ::
+
+        rd = dc.open_resource("cacert",check=True)
+        while rd.remaining():
+            data = rd.read()
+            # do something with data
+
+    The attributes :samp:`size` and :samp:`format` hold the size and the format of the resource.
+
+    """
+    def __init__(self,dcz,entry,check=False,chunk=256):
+        self.dcz = dcz
+        self.addr = entry[1][entry[-1]]
+        self.size = entry[2]
+        self.format = entry[3]
+        self.chksum = entry[4]
+        self.pos = 0
+        self.buf = bytearray(chunk)
+        self.ck = Fletcher32() if check else None
+
+    def remaining(self):
+        """
+.. method:: remaining()
+
+        Return the number of bytes still to be read.
+
+        """
+        return self.size-self.pos
+
+    def readinto(self,buf):
+        """
+.. method:: readinto(buf)
+
+        Read the next chunk of the resource into :samp:`buf`, filling it if enough data is left. Return the number of bytes read, 0 at the end of the resource.
+
+        """
+        n = self.size-self.pos
+        if n>len(buf):
+            n = len(buf)
+        if n<=0:
+            return 0
+        self.dcz.lock_read()
+        try:
+            # counted as part of open_resource
+            self.dcz.begin("open_resource",0)
+            self.dcz.get_zone(self.addr+self.pos,n,buf)
+            if self.ck is not None and self.dcz.counters is not None:
+                self.dcz.count("checksum_bytes",n)
+        finally:
+            self.dcz.end()
+            self.dcz.unlock_read()
+        self.pos+=n
+        if self.ck is not None:
+            self.ck.update(buf,n)
+            if self.pos==self.size and self.ck.digest()!=self.chksum:
+                raise DCZChecksumError
+        return n
+
+    def read(self):
+        """
+.. method:: read()
+
+        Read the next chunk of the resource and return it. The returned bytearray is the internal buffer of the reader and is overwritten by the next call,
+        only the last chunk (if shorter) is returned as a new bytearray. An empty bytearray is returned at the end of the resource.
+
+        """
+        n = self.readinto(self.buf)
+        if n==len(self.buf):
+            return self.buf
+        return self.buf[:n]
+
+
+class LZReader():
+    """
+==============
+LZReader class
+==============
+
+.. class:: LZReader(reader,chunk=256)
+
+    A reader decompressing on the fly a resource in the "lz" format (see :func:`lz_compress`) read from :samp:`reader`, any object with a :samp:`readinto(buf)` method
+    like a :class:`DCZReader`. Compressed data is read in chunks of at most :samp:`chunk` bytes and only the last 1024 decompressed bytes are kept in RAM,
+    therefore big resources can be decompressed with little memory. Readers are usually obtained by calling :meth:`DCZ.open_resource` with :samp:`decompress` set to :samp:`True`.
+
+    The attributes :samp:`size` and :samp:`format` hold the size and the format of the decompressed resource.
+    If the compressed data is truncated or corrupted, :samp:`ValueError` is raised.
+
+    """
+    def __init__(self,reader,chunk=256):
+        self.reader = reader
+        self.src = bytearray(chunk)
+        self.start = 0
+        self.end = 0
+        self.state = bytearray(LZ_STATE_SIZE)
+        self.buf = bytearray(chunk)
+        hdr = bytearray(LZ_HEADER_SIZE)
+        n = 0
+        while n<LZ_HEADER_SIZE:
+            # readers may return less than asked
+            part = bytearray(LZ_HEADER_SIZE-n)
+            got = reader.readinto(part)
+            if not got:
+                # truncated
+                raise ValueError
+            hdr[n:n+got]=part[0:got]
+            n+=got
+        self.format = _get_str(hdr,0,4)
+        self.size = _get_int(hdr,4,4)
+        self.pos = 0
+
+    def remaining(self):
+        """
+.. method:: remaining()
+
+        Return the number of decompressed bytes still to be read.
+
+        """
+        return self.size-self.pos
+
+    def readinto(self,buf):
+        """
+.. method:: readinto(buf)
+
+        Decompress the next chunk of the resource into :samp:`buf`, filling it if enough data is left. Return the number of bytes decompressed, 0 at the end of the resource.
+
+        """
+        n = 0
+        while n<len(buf) and self.pos<self.size:
+            # a pending match or literal run can produce data with no input left: decode first
+            self.start, produced = _lz_decode(self.state,self.src,self.start,self.end,buf,n)
+            n+=produced
+            self.pos+=produced
+            if not produced and self.start==self.end:
+                self.start = 0
+                self.end = self.reader.readinto(self.src)
+                if not self.end:
+                    # truncated
+                    raise ValueError
+        return n
+
+    def read(self):
+        """
+.. method:: read()
+
+        Decompress the next chunk of the resource and return it, reusing the internal buffer like :meth:`DCZReader.read`.
+
+        """
+        n = self.readinto(self.buf)
+        if n==len(self.buf):
+            return self.buf
+        return self.buf[:n]
+
+
+class DCZWriter():
+    """
+===============
+DCZWriter class
+===============
+
+.. class:: DCZWriter(dcz,entry,new_version)
+
+    A writer for the resource identified by :samp:`entry` (see :meth:`DCZ.get_entry`). Writers are usually obtained by calling :meth:`DCZ.open_writer`.
+
+    Data given to :meth:`write` is written sequentially to the resource address of the DCZ identified by :samp:`new_version` and checksummed incrementally.
+    The DCZ entry and header are updated by :meth:`close`: ::
+
+        wr = dc.open_writer("cacert",version=dc.next_version())
+        for chunk in chunks:
+            wr.write(chunk)
+        wr.close()
+
+    Since a writer has a :samp:`write` method, serializers able to dump to a stream can write into it directly.
+
+    Since flash sectors are erased when written, data is collected in a RAM buffer of one sector (see :class:`Flash`) and each sector is written
+    once, when complete or at :meth:`close`. The bytes of the first and last sector outside the resource are read and written back unchanged.
+
+    """
+    def __init__(self,dcz,entry,new_version):
+        self.dcz = dcz
+        self.entry = entry
+        self.new_version = new_version
+        self.version = dcz.handle_version(new_version,entry[-1])
+        self.addr = entry[1][self.version]
+        self.pos = 0
+        self.ck = Fletcher32()
+        # data is collected in a sector and written when the sector is complete:
+        # the bytes of the first sector before the resource are kept
+        self.sector = dcz.flash.sector
+        self.buf = bytearray(self.sector)
+        self.base = self.addr-self.addr%self.sector
+        self.fill = self.addr-self.base
+        self.dirty = False
+        if self.fill:
+            dcz.get_zone(self.base,self.fill,self.buf)
+
+    def write(self,data,size=-1):
+        """
+.. method:: write(data,size=-1)
+
+        Write the first :samp:`size` bytes of :samp:`data` (all of them if :samp:`size` is negative) and return the number of bytes written.
+
+        """
+        if size<0:
+            size = len(data)
+        elif size<len(data):
+            data = data[:size]
+        i = 0
+        while i<size:
+            n = min(size-i,self.sector-self.fill)
+            self.buf[self.fill:self.fill+n]=data[i:i+n]
+            self.fill+=n
+            self.dirty = True
+            i+=n
+            if self.fill==self.sector:
+                self.flush()
+        if self.dcz.counters is not None:
+            # counted as part of open_writer
+            self.dcz.begin("open_writer",0)
+            self.dcz.count("checksum_bytes",size)
+            self.dcz.end()
+        self.ck.update(data,size)
+        self.pos+=size
+        return size
+
+    def flush(self):
+        # write the current sector, erasing it once
+        self.dcz.lock_write()
+        try:
+            self.dcz.begin("open_writer",0)
+            if self.fill<self.sector:
+                # keep the bytes of the last sector after the resource
+                self.buf[self.fill:]=self.dcz.get_zone(self.base+self.fill,self.sector-self.fill)
+            self.dcz.set_zone(self.base,self.buf)
+        finally:
+            self.dcz.end()
+            self.dcz.unlock_write()
+        self.base+=self.sector
+        self.fill = 0
+        self.dirty = False
+
+    def close(self):
+        """
+.. method:: close()
+
+        Update the DCZ with size and checksum of the written data. Return a tuple with the resource address and the DCZ address.
+
+        """
+        if self.dirty:
+            self.flush()
+        entry = self.entry
+        entry[2]=self.pos
+        entry[4]=self.ck.digest()
+        self.dcz.lock_write()
+        try:
+            self.dcz.begin("open_writer",0)
+            addr = self.dcz.update_dcz([entry],self.version,self.new_version)
+        finally:
+            self.dcz.end()
+            self.dcz.unlock_write()
+        return self.addr, addr
+
+
 class DCZ():
     """
 =========
 DCZ class
 =========
     
-.. class:: DCZ(mapping, serializers={})
+.. class:: DCZ(mapping, serializers={}, index=True, cache=0, cache_size=0, flash=None, instrument=False, lazy=False, recover=False, repair=False, on_fallback=None, threadsafe=False, logs={})
 
     Create an instance of the DCZ class providing the following arguments:
 
     * :samp:`mapping`, a list of addresses where the various DCZ versions start (in ascending order of version). A max of 8 addresses can be given.
     * :samp:`serializers`, a dict mapping format names to serialization/deserialization modules.
+    * :samp:`index`, if :samp:`True` the entries of all DCZs are kept in RAM and resources are found without reading the flash. If :samp:`False`, no entry is kept in RAM and every lookup reads the DCZ table and searches it natively, decoding only the matching entry.
+    * :samp:`cache`, the maximum number of deserialized resources kept in RAM by :meth:`load_resource`. If zero, no resource is cached.
+    * :samp:`cache_size`, the maximum total size in bytes (as stored in the DCZ) of the cached resources. If zero, only :samp:`cache` limits the cache.
+    * :samp:`flash`, the storage backend used to read, write, encrypt and decrypt DCZs and resources. If not given, a :class:`Flash` instance is used.
+    * :samp:`instrument`, if :samp:`True` flash operations, native calls, checksums, encryptions and serializations are counted (see :meth:`stats`).
+    * :samp:`lazy`, if :samp:`True` only the DCZ headers are read at creation, see :meth:`init`.
+    * :samp:`recover`, if :samp:`True` :meth:`load_resource` falls back to older copies of a resource when the requested one is corrupted.
+    * :samp:`repair`, if :samp:`True` together with :samp:`recover`, corrupted copies are rewritten with the intact copy used as fallback:
+      in the background if :samp:`threadsafe` is :samp:`True`, otherwise before the load returns.
+    * :samp:`on_fallback`, a function called as :samp:`on_fallback(resource, version, zone)` each time the :samp:`resource` is loaded from DCZ :samp:`zone` instead of DCZ :samp:`version`.
+    * :samp:`threadsafe`, if :samp:`True` the DCZ instance can be shared by many threads: resources can be loaded by many threads at the same time,
+      while saving resources, finalizing and initializing are done by one thread at a time and wait for all the pending loads to complete.
+    * :samp:`logs`, a dict mapping resource names to the size in bytes of the slot reserved to them at each of their addresses, see below.
 
     Format names are strings of at most 4 bytes, while serialization modules must provide a :samp:`.loads(bytes)` and :samp:`.dumps(obj)` to be used.
+    The "kv" format is built in: flat dicts with string keys and string or integer values are encoded and decoded natively (see :func:`kv_dumps`), much faster than json.
+    The "lz" format is built in too: resources saved with :samp:`compress` set to :samp:`True` are decompressed and then deserialized with the serializer
+    of their original format, as if they were saved uncompressed. Loading them without deserialization returns the compressed data.
 
     To use json and cbor: ::
 
@@ -174,70 +929,162 @@ DCZ class
    
     After creation, the DCZ instance contain a :samp:`latest_version` field containing the highest available version of the stored DCZs.
 
+    When the cache is enabled, :meth:`load_resource` returns the same object to all the callers loading the same resource, until the resource is saved again.
+    Cached objects must therefore be treated as read only. The least recently used resources are evicted first, see also :meth:`cache_stats`.
+
+    Resources named in :samp:`logs` are saved in append mode: when a resource is saved in its current DCZ version with its stored format, the new value is appended
+    as a checksummed record to the free space of its slot, without erasing the flash and without rewriting the DCZ table. Loads return the value of the latest
+    valid record, or the resource as stored in the DCZ if there is none. When the slot is full, or a new version is saved, the resource is saved as usual and the rest of the slot
+    is erased, making room for new records. The slot of a resource in append mode must therefore be reserved in the DCZ layout and not used by other resources,
+    and saving a resource bigger than its slot raises :samp:`ValueError`. Encrypted resources are always saved as usual.
+    Records are written without erasing only if the storage backend is :samp:`programmable` (see :class:`Flash`), otherwise the whole slot is rewritten
+    with the new record: the DCZ table is still left untouched.
+
 .. note:: All methods expecting an optional version number will operate the :samp:`latest_version` if no version is given,
     otherwise they will operate on the DCZ slot correspondent to the given version modulo the replication number.
 
     """
-    def __init__(self,mapping,serializers={}):
+    def __init__(self,mapping,serializers={},index=True,cache=0,cache_size=0,flash=None,instrument=False,lazy=False,recover=False,repair=False,on_fallback=None,threadsafe=False,logs={}):
         self.addr = mapping
+        self.rwlock = RWLock() if threadsafe else None
+        self.cache_lock = threading.Lock() if threadsafe else None
+        self.load_lock = threading.Lock() if threadsafe else None
+        self.flash = flash if flash is not None else Flash()
+        self.counters = {} if instrument else None
+        self.op = "other"
         self.modulo = len(mapping)
         self.deserializers = serializers
+        self.indexed = index
+        self.lazy = lazy
+        self.recover = recover
+        self.repair = repair
+        self.on_fallback = on_fallback
+        self.logs = logs
+        self.cache_max = cache
+        self.cache_max_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.latest_version = 0
         self.init()
 
-    def init(self):
-        # retrieve both headers
-        self.dcz_size = []
-        self.dcz_chksum = []
-        self.dcz_version = []
-        self.dcz_entries = []
-        self.dcz_valid = [False]*self.modulo
-        v=-1
-        vp=-1
-        cardinality=0
-        for i in range(self.modulo):
-            size0, version0, entries0, chksum0, cardinality = self.get_header(i)
-            self.dcz_size.append(size0)
-            self.dcz_chksum.append(chksum0)
-            self.dcz_version.append(version0)
-            self.dcz_entries.append(entries0)
-            self.dcz_valid[i]=self.check_dcz(i)
-            if version0>v:
-                v = version0
-                vp = i
-        self.latest_version = v
-        self.cardinality = cardinality
-
-    def finalize(self):
-        """
-.. method:: finalize()
-
-    This method scans all the DCZs and all the resources. For each DCZ it calculates the checksum and checks it against
-    the one in the DCZ. If they do not match the DCZ is marked as invalid. For each resource of valid DCZs that is marked
+    def init(self,lazy=None):
+        """
+.. method:: init(lazy=None)
+
+    Read all the DCZs, check their checksums and find the :samp:`latest_version`. This method is called at creation.
+
+    If :samp:`lazy` is :samp:`True`, only the DCZ headers are read: each DCZ is read and validated only the first time
+    one of its resources is accessed, moving most of the DCZ reading out of the boot time. All the DCZs can be validated at once with :meth:`validate_all`.
+    If :samp:`lazy` is not given, the :samp:`lazy` value given at creation is used.
+
+        """
+        self.lock_write()
+        try:
+            self.begin("init")
+            if lazy is not None:
+                self.lazy = lazy
+            # retrieve all tables
+            self.dcz_size = []
+            self.dcz_chksum = []
+            self.dcz_version = []
+            self.dcz_entries = []
+            # None marks a DCZ not validated yet
+            self.dcz_valid = [None]*self.modulo
+            self.dcz_table = []
+            self.dcz_index = []
+            self.cache_clear()
+            v=-1
+            vp=-1
+            cardinality=0
+            for i in range(self.modulo):
+                if self.lazy:
+                    header = self.get_header(i)
+                    table = None
+                else:
+                    header, chksum, table = self.read_dcz(i,self.indexed)
+                size0, version0, entries0, chksum0, cardinality = header
+                self.dcz_size.append(size0)
+                self.dcz_chksum.append(chksum0)
+                self.dcz_version.append(version0)
+                self.dcz_entries.append(entries0)
+                if not self.lazy:
+                    self.dcz_valid[i]=chksum0==chksum
+                self.dcz_table.append(table)
+                self.dcz_index.append(self.index_table(table) if table is not None else None)
+                if version0>v:
+                    v = version0
+                    vp = i
+            self.latest_version = v
+            self.cardinality = cardinality
+        finally:
+            self.end()
+            self.unlock_write()
+
+    def finalize(self,progress=None):
+        """
+.. method:: finalize(progress=None)
+
+    This method scans all the DCZs and all the resources. Each DCZ not yet validated is validated (see :meth:`init`) and
+    invalid DCZs are skipped. For each resource of valid DCZs that is marked
     as requiring encryption, the resource is read (in binary format), encrypted, stored back to its address and marked as encrypted.
+    Each DCZ is rewritten once after all its resources have been encrypted. DCZs with no resource left
+    to encrypt are skipped without reading any resource.
+
+    If given, :samp:`progress` is called after each encrypted resource as :samp:`progress(dcz, resource, done, total)` where :samp:`dcz` is the index
+    of the DCZ, :samp:`resource` is the name of the resource and :samp:`done` is the number of encrypted resources out of :samp:`total` for that DCZ.
+
+    If the method is interrupted (i.e. by a power loss), it can be safely run again: resources already encrypted by the previous run are recognized
+    by their checksum and marked as encrypted without encrypting them twice.
 
     This method is suggested to be run at end of line testing for each device that requires encrypted resources.
 
+    Return the number of resources marked as encrypted.
+
         """
-        # finalize all tables
-        for i in range(self.modulo):
-            entries = self.dcz_entries[i]
-            if not self.check_dcz(i):
-                # skip broken dcz
-                self.dcz_valid[i]=False
-                continue
-            self.dcz_valid[i]=True
-            for j in range(entries):
-                entry = self.get_entry(j,i)  # entry j for table i
-                if entry[5] and not entry[6]: #requires encryption but is not encrypted!
+        self.lock_write()
+        try:
+            self.begin("finalize")
+            # finalize all tables
+            count = 0
+            for i in range(self.modulo):
+                self.load_dcz(i)
+                if not self.dcz_valid[i]:
+                    # skip broken dcz
+                    continue
+                pending = []
+                for entry in self.get_table(i):
+                    if entry[5] and not entry[6]: #requires encryption but is not encrypted!
+                        pending.append(entry[:])
+                if not pending:
+                    # already finalized
+                    continue
+                done = []
+                for entry in pending:
                     resource_addr = entry[1][i]
-                    bin = self.get_zone(resource_addr,entry[2]) #read resource
+                    bin = self.load_entry(entry) #read resource
                     chk = entry[4]
-                    #encrypt
-                    __vmctrl(3,0,chk,bin)
-                    entry[5]=1
+                    if self.checksum(bin)==chk:
+                        #encrypt
+                        self.encrypt_data(chk,bin)
+                        self.set_zone(resource_addr,bin)
+                    else:
+                        # already encrypted by an interrupted finalize?
+                        self.decrypt_data(chk,bin)
+                        if self.checksum(bin)!=chk:
+                            # corrupted, leave it as is
+                            continue
+                    bin = None
                     entry[6]=1
-                    self.save_entry(entry,bin)
+                    done.append(entry)
+                    if progress:
+                        progress(i,entry[0],len(done),len(pending))
+                if done:
+                    self.update_dcz(done,i,self.dcz_version[i])
+                    count+=len(done)
+            return count
+        finally:
+            self.end()
+            self.unlock_write()
 
 
     def handle_version(self,version,default):
@@ -251,8 +1098,7 @@ DCZ class
 .. method:: load_resource(resource,version=None,check=False,deserialize=True,decrypt=True)
 
     This is the method of choice to retrieve resources.
-    It scans the DCZ identified by :samp:`version` and all its entries to find the one with the same name
-    specified by the parameter :samp:`resource`.
+    It looks up the entry with the same name specified by the parameter :samp:`resource` in the index of the DCZ identified by :samp:`version`.
     If the :samp:`check` parameter is :samp:`True`, the :samp:`DCZChecksumError` is raised if the entry checksum in the DCZ
     is not the same as the calculated checksum of the resource data.
 
@@ -263,54 +1109,485 @@ DCZ class
     When :samp:`deserialize` is :samp:`False`, the binary representation of the resource is returned.
 
     If no resource with name :samp:`resource` can be found, :samp:`DCZNoResourceError` is raised.
+
+    If the DCZ instance has been created with :samp:`recover=True` and the DCZ identified by :samp:`version` is invalid or the resource checksum
+    does not match (:samp:`check` must be :samp:`True` to detect it), the resource is loaded from the valid DCZ with the highest version having an intact copy of it.
+    The copies in the other DCZs are always checked. :samp:`DCZChecksumError` is raised only if no intact copy can be found.
+    Copies can be repaired only if they are expected to hold the same data of the intact copy (same size and checksum) and their DCZ is valid.
  
         """
-        version = self.handle_version(version,self.latest_version)
-        for i in range(self.dcz_entries[version]):
-            entry = self.get_entry(i,version)
-            if entry[0]==resource:
-                # let's get binary data
-                fmt = entry[3]
-                chk = entry[4]
-                enc = entry[5]
-                is_enc = entry[6]
+        self.lock_read()
+        try:
+            self.begin("load_resource")
+            version = self.handle_version(version,self.latest_version)
+            if self.recover:
+                return self.load_recovering(resource,version,check,deserialize,decrypt)
+            entry = self.find_entry(resource,version)
+            return self.load_data(entry,check,deserialize,decrypt)
+        finally:
+            self.end()
+            self.unlock_read()
+
+    def load_data(self,entry,check=False,deserialize=True,decrypt=True,buf=None):
+        # load the resource of entry, see load_resource
+        # if buf is given, it already holds the binary data and the cache has already been looked up
+        if buf is None and deserialize and self.cache_max:
+            cached = self.cached(entry,check)
+            if cached is not None:
+                return cached[1]
+        # let's get binary data
+        fmt = entry[3]
+        chk = entry[4]
+        enc = entry[5]
+        is_enc = entry[6]
+        if buf is None:
+            if entry[0] in self.logs:
+                buf, chk = self.read_log(entry)
+            else:
                 buf = self.load_entry(entry)
-                # let's decrypt
-                if enc and is_enc:
-                    __vmctrl(4,0,chk,buf)
-                # let's calculate checksum
-                if check:
-                    chksum = fletcher32(buf)
-                    if chk!=chksum:
-                        # ouch, corruption!
-                        raise DCZChecksumError
-                if not deserialize:
-                    if enc and is_enc and not decrypt:
-                        #encrypt back
-                        __vmctrl(3,0,chk,buf)
-                    return buf
-                else:
-                    # let's deserialize
-                    if fmt=="bin":
-                        return buf
-                    else:
-                        if fmt not in self.deserializers:
-                            # ouch, no deserializer given
-                            raise DCZMissingSerializerError
-                        dds = self.deserializers[fmt]
-                        return dds.loads(buf)
+        # let's decrypt
+        if enc and is_enc:
+            self.decrypt_data(chk,buf)
+        # let's calculate checksum
+        if check:
+            chksum = self.checksum(buf)
+            if chk!=chksum:
+                # ouch, corruption!
+                raise DCZChecksumError
+        if not deserialize:
+            if enc and is_enc and not decrypt:
+                #encrypt back
+                self.encrypt_data(chk,buf)
+            return buf
         else:
+            # let's deserialize
+            if fmt==LZ_FORMAT:
+                fmt, buf = lz_decompress(buf)
+            if fmt=="bin":
+                obj = buf
+            elif fmt==KV_FORMAT:
+                obj = kv_loads(buf)
+            else:
+                if fmt not in self.deserializers:
+                    # ouch, no deserializer given
+                    raise DCZMissingSerializerError
+                dds = self.deserializers[fmt]
+                if self.counters is not None:
+                    t0 = timers.now()
+                    obj = dds.loads(buf)
+                    self.count("serializer_ms",timers.now()-t0)
+                else:
+                    obj = dds.loads(buf)
+            if self.cache_max:
+                if self.cache_lock is not None:
+                    self.cache_lock.acquire()
+                self.cache_put(entry,obj,check)
+                if self.cache_lock is not None:
+                    self.cache_lock.release()
+            return obj
+
+    def load_recovering(self,resource,version,check,deserialize,decrypt):
+        # load resource from the DCZ identified by version, falling back to the other DCZs on corruption
+        self.load_dcz(version)
+        if self.dcz_valid[version]:
+            try:
+                return self.load_data(self.find_entry(resource,version),check,deserialize,decrypt)
+            except DCZChecksumError:
+                pass
+        try:
+            broken = self.find_entry(resource,version)
+        except DCZNoResourceError:
+            # the table of an invalid DCZ may not list the resource: the other DCZs can still have it
+            broken = None
+        for zone in self.fallback_zones(version):
+            self.load_dcz(zone)
+            if not self.dcz_valid[zone]:
+                continue
+            try:
+                entry = self.find_entry(resource,zone)
+                res = self.load_data(entry,True,deserialize,decrypt)
+            except DCZNoResourceError:
+                continue
+            except DCZChecksumError:
+                continue
+            if self.on_fallback is not None:
+                self.on_fallback(resource,version,zone)
+            if self.repair and broken is not None and self.dcz_valid[version] and broken[2]==entry[2] and broken[4]==entry[4] and broken[6]==entry[6]:
+                # same data expected in both slots, the broken one can be rewritten
+                if self.rwlock is not None:
+                    # in the background, once the pending loads are done
+                    thread(self.repair_slot,broken,entry)
+                else:
+                    self.repair_slot(broken,entry)
+            return res
+        if self.dcz_valid[version]:
+            # no intact copy anywhere
+            raise DCZChecksumError
+        if broken is None:
             raise DCZNoResourceError
+        # last resort: the DCZ is invalid, but the resource may still be good
+        return self.load_data(broken,check,deserialize,decrypt)
+
+    def fallback_zones(self,version):
+        # all the other DCZs, newest version first
+        zones = []
+        for i in range(self.modulo):
+            if i==version:
+                continue
+            j = len(zones)
+            zones.append(i)
+            while j>0 and self.dcz_version[zones[j-1]]<self.dcz_version[i]:
+                zones[j]=zones[j-1]
+                j-=1
+            zones[j]=i
+        return zones
+
+    def repair_slot(self,broken,entry):
+        # copy the resource of entry as stored (maybe encrypted) over the corrupted copy of broken,
+        # only if both are still as they were when the load fell back: resources may be saved in the meantime
+        self.lock_write()
+        try:
+            if not self.dcz_valid[broken[-1]] or not self.dcz_valid[entry[-1]]:
+                return
+            try:
+                current = self.find_entry(broken[0],broken[-1])
+                source = self.find_entry(entry[0],entry[-1])
+            except DCZNoResourceError:
+                return
+            if not self.same_slot(current,broken) or not self.same_slot(source,entry):
+                return
+            try:
+                self.load_data(current,True,False,True)
+                # the slot is not corrupted anymore
+                return
+            except DCZChecksumError:
+                pass
+            try:
+                bin = self.load_data(source,True,False,False)
+            except DCZChecksumError:
+                return
+            self.set_zone(current[1][current[-1]],bin)
+            self.cache_drop(current[-1],current[0])
+        finally:
+            self.unlock_write()
+
+    def same_slot(self,a,b):
+        # True if entries a and b describe the same data at the same address
+        return a[1][a[-1]]==b[1][b[-1]] and a[2]==b[2] and a[4]==b[4] and a[6]==b[6]
+
+    def cached(self,entry,check):
+        # cache_get, safe for concurrent readers
+        if self.cache_lock is not None:
+            self.cache_lock.acquire()
+        cached = self.cache_get(entry,check)
+        if self.cache_lock is not None:
+            self.cache_lock.release()
+        return cached
+
+    def cache_get(self,entry,check):
+        # return the cached item for entry or None, a cached item is [checksum, object, size, checked]
+        key = entry[0]
+        version = entry[-1]
+        cache = self.cache_data[version]
+        if key in cache:
+            item = cache[key]
+            if item[0]==entry[4] and (item[3] or not check):
+                self.cache_hits+=1
+                # move to most recently used
+                lru = self.cache_lru
+                for i in range(len(lru)):
+                    if lru[i][0]==version and lru[i][1]==key:
+                        lru.append(lru.pop(i))
+                        break
+                return item
+            self.cache_drop(version,key)
+        self.cache_misses+=1
+        return None
+
+    def cache_put(self,entry,obj,check):
+        sz = entry[2]
+        if self.cache_max_size and sz>self.cache_max_size:
+            return
+        key = entry[0]
+        version = entry[-1]
+        self.cache_drop(version,key)
+        self.cache_data[version][key]=[entry[4],obj,sz,check]
+        self.cache_lru.append([version,key])
+        self.cache_bytes+=sz
+        # evict least recently used
+        while len(self.cache_lru)>self.cache_max or (self.cache_max_size and self.cache_bytes>self.cache_max_size):
+            version, key = self.cache_lru[0]
+            self.cache_drop(version,key)
+
+    def cache_drop(self,version,key):
+        cache = self.cache_data[version]
+        if key not in cache:
+            return
+        self.cache_bytes-=cache[key][2]
+        del cache[key]
+        lru = self.cache_lru
+        for i in range(len(lru)):
+            if lru[i][0]==version and lru[i][1]==key:
+                lru.pop(i)
+                break
+
+    def cache_clear(self):
+        """
+.. method:: cache_clear()
+
+    Remove all the resources from the cache.
+
+        """
+        self.cache_data = []
+        for i in range(self.modulo):
+            self.cache_data.append({})
+        self.cache_lru = []
+        self.cache_bytes = 0
+
+    def cache_stats(self):
+        """
+.. method:: cache_stats()
+
+    Return a tuple with the number of cache hits, the number of cache misses, the number of cached resources and their total size in bytes.
+
+        """
+        return self.cache_hits, self.cache_misses, len(self.cache_lru), self.cache_bytes
+
+
+    def load_resources(self,resources,version=None,check=False,deserialize=True,decrypt=True,gap=256):
+        """
+.. method:: load_resources(resources,version=None,check=False,deserialize=True,decrypt=True,gap=256)
+
+    Load all the resources named in the list :samp:`resources` and return a list with their data in the same order.
+    The other parameters have the same meaning as in :method:`load_resource`.
+
+    All the resources are looked up at once and read in order of address: resources stored at less than :samp:`gap` bytes
+    one from the other are read with a single flash read, trading some extra bytes read for fewer flash transactions.
+
+        """
+        self.lock_read()
+        try:
+            self.begin("load_resources")
+            version = self.handle_version(version,self.latest_version)
+            if self.recover:
+                self.load_dcz(version)
+                if not self.dcz_valid[version]:
+                    # nothing to coalesce, every resource may come from a different DCZ
+                    res = []
+                    for resource in resources:
+                        res.append(self.load_recovering(resource,version,check,deserialize,decrypt))
+                    return res
+            entries = self.find_entries(resources,version)
+            res = [None]*len(resources)
+            # sort by address the resources to read
+            order = []
+            for i in range(len(entries)):
+                entry = entries[i]
+                if entry[0] in self.logs:
+                    # the latest value is somewhere in the log, load it on its own
+                    res[i]=self.load_checked(entry,version,check,deserialize,decrypt)
+                    continue
+                if deserialize and self.cache_max:
+                    cached = self.cached(entry,check)
+                    if cached is not None:
+                        res[i]=cached[1]
+                        continue
+                j = len(order)
+                order.append(i)
+                while j>0 and entries[order[j-1]][1][version]>entry[1][version]:
+                    order[j]=order[j-1]
+                    j-=1
+                order[j]=i
+            # read groups of near resources at once
+            g = 0
+            while g<len(order):
+                start = entries[order[g]][1][version]
+                end = start+entries[order[g]][2]
+                h = g+1
+                while h<len(order):
+                    entry = entries[order[h]]
+                    if entry[1][version]>end+gap:
+                        break
+                    if entry[1][version]+entry[2]>end:
+                        end = entry[1][version]+entry[2]
+                    h+=1
+                bin = self.get_zone(start,end-start)
+                for k in range(g,h):
+                    i = order[k]
+                    entry = entries[i]
+                    pos = entry[1][version]-start
+                    res[i]=self.load_checked(entry,version,check,deserialize,decrypt,bin[pos:pos+entry[2]])
+                bin = None
+                g = h
+            return res
+        finally:
+            self.end()
+            self.unlock_read()
+
+    def load_checked(self,entry,version,check,deserialize,decrypt,buf=None):
+        # load_data, falling back to the other DCZs on corruption if recover is set
+        try:
+            return self.load_data(entry,check,deserialize,decrypt,buf)
+        except DCZChecksumError:
+            if not self.recover:
+                raise
+            return self.load_recovering(entry[0],version,check,deserialize,decrypt)
+
+    def load_key(self,resource,key,version=None,check=False):
+        """
+.. method:: load_key(resource,key,version=None,check=False)
+
+    Return the value of :samp:`key` in :samp:`resource`, a dict saved in the "kv" format (maybe compressed), without decoding the other keys.
+    :samp:`version` and :samp:`check` have the same meaning as in :method:`load_resource`.
+
+    Resources in the clear are read in chunks of :samp:`KV_CHUNK` bytes up to the key, without loading them entirely in memory.
+    Resources that are encrypted, compressed, in append mode or loaded with :samp:`check` set to :samp:`True` are loaded as a whole.
+
+    If :samp:`key` is missing, :samp:`KeyError` is raised. If the resource is not in the "kv" format, :samp:`ValueError` is raised.
+
+        """
+        self.lock_read()
+        try:
+            self.begin("load_key")
+            version = self.handle_version(version,self.latest_version)
+            entry = self.find_entry(resource,version)
+            if entry[3]==KV_FORMAT and not check and not (entry[5] and entry[6]) and entry[0] not in self.logs:
+                value = self.find_key(entry,key)
+            else:
+                buf = self.load_data(entry,check,False,True)
+                fmt = entry[3]
+                if fmt==LZ_FORMAT:
+                    fmt, buf = lz_decompress(buf)
+                if fmt!=KV_FORMAT:
+                    raise ValueError
+                value = kv_get(buf,key)
+            if value is None:
+                raise KeyError
+            return value
+        finally:
+            self.end()
+            self.unlock_read()
+
+    def find_key(self,entry,key):
+        # look for key in the "kv" resource of entry reading it in chunks, None if missing
+        addr = entry[1][entry[-1]]
+        size = entry[2]
+        if size<2:
+            raise ValueError
+        count = _get_int(self.get_zone(addr,2),0,2)
+        buf = bytearray(KV_CHUNK)
+        pos = 2
+        while count:
+            n = size-pos
+            if n>KV_CHUNK:
+                n = KV_CHUNK
+            if n<=0:
+                # truncated
+                raise ValueError
+            self.get_zone(addr+pos,n,buf)
+            end, done, value = _kv_scan(buf,0,n,key,count)
+            if not done:
+                # an item longer than the chunk, only strings can be: read it whole
+                klen = buf[0]
+                if klen+4>n or buf[klen+1]!=1:
+                    raise ValueError
+                end = klen+4+_get_int(buf,klen+2,2)
+                if pos+end>size:
+                    raise ValueError
+                item = self.get_zone(addr+pos,end)
+                done, value = _kv_scan(item,0,end,key,1)[1:]
+                item = None
+                if not done:
+                    raise ValueError
+            if value is not None:
+                return value
+            pos+=end
+            count-=done
+        return None
+
+    def load_resource_into(self,resource,buf,version=None,check=False,decrypt=True):
+        """
+.. method:: load_resource_into(resource,buf,version=None,check=False,decrypt=True)
+
+    Read the binary representation of :samp:`resource` into the preallocated bytearray :samp:`buf` and return the number of bytes read.
+    No memory is allocated, therefore the same :samp:`buf` can be reused to load resources without fragmenting the heap.
+
+    :samp:`buf` must be at least as big as the resource, otherwise :samp:`ValueError` is raised. Encrypted resources are decrypted
+    as a whole, therefore :samp:`buf` must have exactly the size of the resource when :samp:`decrypt` or :samp:`check` are :samp:`True`.
+
+    The :samp:`check` parameter has the same meaning as in :method:`load_resource`.
 
+    Resources in append mode are loaded in a temporary bytearray before being copied to :samp:`buf`.
 
-    def save_resource(self,resource,data,version=None,format="bin",serialize=True):
         """
-.. method:: save_resource(resource,version=None,format="bin",serialize=True)
+        self.lock_read()
+        try:
+            self.begin("load_resource_into")
+            version = self.handle_version(version,self.latest_version)
+            entry = self.find_entry(resource,version)
+            if entry[0] in self.logs:
+                bin = self.load_data(entry,check,False,decrypt)
+                if len(buf)<len(bin):
+                    raise ValueError
+                buf[0:len(bin)]=bin
+                return len(bin)
+            sz = entry[2]
+            chk = entry[4]
+            is_enc = entry[5] and entry[6]
+            if len(buf)<sz or (is_enc and (decrypt or check) and len(buf)!=sz):
+                raise ValueError
+            self.load_entry(entry,buf)
+            if is_enc and (decrypt or check):
+                self.decrypt_data(chk,buf)
+            if check:
+                if self.counters is not None:
+                    self.count("checksum_bytes",sz)
+                if Fletcher32().update(buf,sz).digest()!=chk:
+                    raise DCZChecksumError
+                if is_enc and not decrypt:
+                    #encrypt back
+                    self.encrypt_data(chk,buf)
+            return sz
+        finally:
+            self.end()
+            self.unlock_read()
+
+    def open_resource(self,resource,version=None,check=False,chunk=256,decompress=False):
+        """
+.. method:: open_resource(resource,version=None,check=False,chunk=256,decompress=False)
+
+    Return a :class:`DCZReader` to read the binary representation of :samp:`resource` in chunks of at most :samp:`chunk` bytes,
+    without loading it entirely in memory. If :samp:`check` is :samp:`True`, the checksum is calculated while reading and
+    :samp:`DCZChecksumError` is raised when the last chunk is read and the checksum does not match.
+
+    If :samp:`decompress` is :samp:`True` and the resource is in the "lz" format, a :class:`LZReader` is returned instead, to read the decompressed resource.
+
+    Encrypted resources can only be decrypted as a whole and can't be streamed: :samp:`ValueError` is raised for them and for resources in append mode.
+
+        """
+        self.lock_read()
+        try:
+            self.begin("open_resource")
+            version = self.handle_version(version,self.latest_version)
+            entry = self.find_entry(resource,version)
+            if (entry[5] and entry[6]) or entry[0] in self.logs:
+                raise ValueError
+            rd = DCZReader(self,entry,check,chunk)
+        finally:
+            self.end()
+            self.unlock_read()
+        if decompress and rd.format==LZ_FORMAT:
+            # the reader takes the lock by itself
+            return LZReader(rd,chunk)
+        return rd
+
+    def save_resource(self,resource,data,version=None,format="bin",serialize=True,compress=False):
+        """
+.. method:: save_resource(resource,version=None,format="bin",serialize=True,compress=False)
 
     This is method is used to update resources.
 
-    It scans the DCZ identified by :samp:`version` and all its entries to find the one with the same name
-    specified by the parameter :samp:`resource`. If :samp:`version` is not present, the DCZ matching the modulo operation with the replication
+    It looks up the entry with the same name specified by the parameter :samp:`resource` in the index of the DCZ identified by :samp:`version`. If :samp:`version` is not present, the DCZ matching the modulo operation with the replication
     number is selected and promoted to the new version.
 
     When :samp:`serialize` is :samp:`True` an attempt to serialize the resource data is made by passing it
@@ -319,18 +1596,248 @@ DCZ class
     is raised. If serialization is successful, the serialized resource is saved and the DCZ updated accordingly.
     When a resource is marked for encryption, the resource is automatically encrypted and stored.
 
+    If :samp:`compress` is :samp:`True`, the serialized resource is compressed and saved in the "lz" format, unless compression does not reduce its size (see :func:`lz_compress`).
+
     If no resource with name :samp:`resource` can be found, :samp:`DCZNoResourceError` is raised.
 
+    Resources in append mode are appended to their slot when possible, see :class:`DCZ`.
+
     Return a tuple with the resource address and the DCZ address
  
         """
-        new_version = None
-        if version is not None:
-            new_version = version
+        self.lock_write()
+        try:
+            self.begin("save_resource")
+            version, new_version = self.handle_new_version(version)
+            entry, bin = self.prepare_entry(resource,data,version,format,serialize,compress)
+            if self.append_log(entry,bin,version,new_version):
+                return entry[1][version], self.addr[version]
+            return self.store_entry(entry,bin,new_version)
+        finally:
+            self.end()
+            self.unlock_write()
+
+    def save_resources(self,resources,version=None,formats={},serialize=True,compress=False):
+        """
+.. method:: save_resources(resources,version=None,formats={},serialize=True,compress=False)
+
+    Update many resources at once. :samp:`resources` is a dict mapping resource names to their data, :samp:`formats` is a dict mapping
+    resource names to their format (if a resource is not in :samp:`formats`, it is saved as "bin").
+    The other parameters have the same meaning as in :method:`save_resource`.
+
+    All the resources are serialized before writing anything, then they are written and the DCZ is updated
+    with a single table rewrite. If an exception is raised during serialization, nothing is saved.
+    If :samp:`version` is the next version, the new DCZ version contains either all the updated resources or none of them.
+
+    Return a tuple with a dict mapping resource names to their address and the DCZ address
+
+        """
+        self.lock_write()
+        try:
+            self.begin("save_resources")
+            version, new_version = self.handle_new_version(version)
+            pending = []
+            for resource in resources:
+                format = formats[resource] if resource in formats else "bin"
+                pending.append(self.prepare_entry(resource,resources[resource],version,format,serialize,compress))
+            return self.store_entries(pending,version,new_version)
+        finally:
+            self.end()
+            self.unlock_write()
+
+    def apply_delta(self,stream,version=None):
+        """
+.. method:: apply_delta(stream,version=None)
+
+    Read a delta package built by the host tool :samp:`host/dcz_delta.py` from :samp:`stream` and apply it. :samp:`stream` can be any object with a :samp:`read(n)` method, like a file, a socket or an http response.
+
+    The delta is applied to the resources of the DCZ with :samp:`latest_version` and the result is saved with :method:`save_resources` to the DCZ identified by :samp:`version`.
+    If :samp:`version` is not given, the next version is used, therefore the whole delta is applied with a single version bump.
+    When saving to a new version, the resources not in the delta are copied to the new DCZ too, if needed.
+
+    The package is read and checked before writing anything: :samp:`ValueError` is raised if the package is malformed or was made against different resources,
+    :samp:`DCZChecksumError` is raised if a patched resource does not match its target checksum.
+
+    Return a tuple with a dict mapping resource names to their address and the DCZ address
+
+        """
+        self.lock_write()
+        try:
+            self.begin("apply_delta")
+            base = self.handle_version(None,self.latest_version)
+            if version is None:
+                version = self.next_version()
+            version, new_version = self.handle_new_version(version)
+            hdr = self.read_delta(stream,DELTA_HEADER_SIZE)
+            if hdr[0:4]!=DELTA_MAGIC:
+                raise ValueError
+            resources = {}
+            formats = {}
+            for i in range(_get_int(hdr,4,2)):
+                rec = self.read_delta(stream,DELTA_RECORD_SIZE)
+                name = _get_str(rec,0,16)
+                size = _get_int(rec,21,4)
+                chk = _get_int(rec,25,4)
+                if rec[20]==0:
+                    # whole resource
+                    bin = self.read_delta(stream,size)
+                else:
+                    # byte ranges over the current resource
+                    old = self.load_data(self.find_entry(name,base),False,False,True)
+                    if self.checksum(old)!=_get_int(rec,29,4):
+                        raise ValueError
+                    bin = bytearray(size)
+                    n = len(old) if len(old)<size else size
+                    bin[0:n]=old[0:n]
+                    old = None
+                    for j in range(_get_int(self.read_delta(stream,2),0,2)):
+                        rng = self.read_delta(stream,6)
+                        pos = _get_int(rng,0,4)
+                        n = _get_int(rng,4,2)
+                        if pos+n>size:
+                            raise ValueError
+                        bin[pos:pos+n]=self.read_delta(stream,n)
+                if self.checksum(bin)!=chk:
+                    raise DCZChecksumError
+                resources[name]=bin
+                formats[name]=_get_str(rec,16,4)
+            pending = []
+            for resource in resources:
+                pending.append(self.prepare_entry(resource,resources[resource],version,formats[resource],False))
+                resources[resource]=None
+            if version!=base:
+                # bring the other resources to the new DCZ
+                for entry in self.get_table(base):
+                    if entry[0] in resources:
+                        continue
+                    if entry[0] in self.logs:
+                        # the latest value is in the log
+                        pending.append(self.prepare_entry(entry[0],self.load_data(entry,False,False,True),version,entry[3],False))
+                        continue
+                    target = self.find_entry(entry[0],version)[:]
+                    if target[5]!=entry[5]:
+                        # the slots disagree on encryption: the stored bytes can't be copied as they are
+                        pending.append(self.prepare_entry(entry[0],self.load_data(entry,False,False,True),version,entry[3],False))
+                        continue
+                    if target[2]==entry[2] and target[3]==entry[3] and target[4]==entry[4] and target[6]==entry[6]:
+                        continue
+                    # the encryption request (index 5) belongs to the slot and is not copied
+                    target[2]=entry[2]
+                    target[3]=entry[3]
+                    target[4]=entry[4]
+                    target[6]=entry[6]
+                    # copied as stored, maybe encrypted
+                    pending.append([target,self.load_entry(entry)])
+            return self.store_entries(pending,version,new_version)
+        finally:
+            self.end()
+            self.unlock_write()
+
+    def read_delta(self,stream,n):
+        # read exactly n bytes of a delta package
+        buf = bytearray(n)
+        pos = 0
+        while pos<n:
+            data = stream.read(n-pos)
+            if not data:
+                # truncated package
+                raise ValueError
+            buf[pos:pos+len(data)]=data
+            pos+=len(data)
+        return buf
+
+    def store_entries(self,pending,version,new_version):
+        # write the [entry, bin] pairs in pending and update the DCZ with a single table rewrite
+        version = self.handle_version(new_version,version)
+        addrs = {}
+        entries = []
+        for i in range(len(pending)):
+            entry, bin = pending[i]
+            # free some mem
+            pending[i]=None
+            resource_addr = entry[1][version]
+            self.set_zone(resource_addr,self.slot_data(entry,bin))
+            bin = None
+            addrs[entry[0]]=resource_addr
+            entries.append(entry)
+        addr = self.update_dcz(entries,version,new_version)
+        return addrs, addr
+
+    def patch_resource(self,resource,offset,data,version=None):
+        """
+.. method:: patch_resource(resource,offset,data,version=None)
+
+    Overwrite the bytes of the binary representation of :samp:`resource` starting at :samp:`offset` with the bytes in :samp:`data`, leaving the rest of the resource untouched.
+    :samp:`version` has the same meaning as in :method:`save_resource`. The patch is always applied to the resource of the DCZ with :samp:`latest_version`.
+
+    When the patched resource is saved to the DCZ with :samp:`latest_version`, only the flash sectors containing the patched region are read and written back (see :class:`Flash`),
+    and the resource checksum is updated without reading the unchanged data. When it is saved to another DCZ (like with :samp:`version=next_version()`),
+    the resource is loaded from the latest DCZ, patched and saved as a whole, since the copy in the other DCZ is out of date.
+    Encrypted resources are loaded, decrypted, patched and saved again as a whole. Resources in append mode are loaded, patched and saved again with :method:`save_resource`.
+
+    If the patch does not fit in the resource, or the resource is compressed (format "lz"), :samp:`ValueError` is raised.
+
+    Return a tuple with the resource address and the DCZ address
+
+        """
+        self.lock_write()
+        try:
+            self.begin("patch_resource")
+            base = self.handle_version(None,self.latest_version)
+            version, new_version = self.handle_new_version(version)
+            entry = self.find_entry(resource,base)[:]
+            if entry[3]==LZ_FORMAT:
+                # offsets refer to the uncompressed data
+                raise ValueError
+            if version!=base or entry[5] or entry[0] in self.logs:
+                # the copy in another DCZ is out of date, encrypted resources depend on their checksum
+                # and logged ones may have a newer value: patch the latest data and rewrite it all
+                bin = self.load_data(entry,False,False,True)
+                if offset<0 or offset+len(data)>len(bin):
+                    raise ValueError
+                for i in range(len(data)):
+                    bin[offset+i]=data[i]
+                entry, bin = self.prepare_entry(resource,bin,version,entry[3],False)
+                if self.append_log(entry,bin,version,new_version):
+                    return entry[1][version], self.addr[version]
+                return self.store_entry(entry,bin,new_version)
+            size = entry[2]
+            if offset<0 or offset+len(data)>size:
+                raise ValueError
+            # extend the region to whole checksum words
+            start = offset&~1
+            end = offset+len(data)
+            if end&1 and end<size:
+                end+=1
+            resource_addr = entry[1][version]
+            # writing erases whole sectors: rewrite them with the patch applied
+            zone, bin = self.get_sectors(resource_addr+start,end-start)
+            pos = resource_addr+start-zone
+            old = bin[pos:pos+end-start]
+            for i in range(len(data)):
+                bin[pos+offset-start+i]=data[i]
+            if self.counters is not None:
+                self.count("checksum_bytes",2*(end-start))
+            entry[4] = _fletcher32_patch(entry[4],size,start,old,bin[pos:pos+end-start])
+            old = None
+            self.set_zone(zone,bin)
+            bin = None
+            addr = self.update_dcz([entry],version,new_version)
+            return resource_addr, addr
+        finally:
+            self.end()
+            self.unlock_write()
+
+    def handle_new_version(self,version):
+        # return the DCZ to update and its new version number
+        new_version = version
         version = self.handle_version(version,self.latest_version)
         if new_version is None:
             new_version = self.dcz_version[version]
-        index = -1
+        return version, new_version
+
+    def prepare_entry(self,resource,data,version,format="bin",serialize=True,compress=False):
+        # serialize, compress and encrypt data, returning the updated copy of the entry and the binary to save
         if len(format)>4:
             raise ValueError
         if len(resource)>16:
@@ -338,33 +1845,71 @@ DCZ class
         if serialize:
             if format=="bin":
                 bin = bytearray(data)
+            elif format==KV_FORMAT:
+                bin = kv_dumps(data)
             elif format not in self.deserializers:
                 raise DCZMissingSerializerError
             else:
                 ss = self.deserializers[format]
-                bin = ss.dumps(data)
+                if self.counters is not None:
+                    t0 = timers.now()
+                    bin = ss.dumps(data)
+                    self.count("serializer_ms",timers.now()-t0)
+                else:
+                    bin = ss.dumps(data)
         else:
             bin=data
+
+        if compress:
+            zbin = lz_compress(bin,format)
+            if zbin is not None:
+                bin = zbin
+                format = LZ_FORMAT
     
-        chksum = fletcher32(bin)
-
-        for i in range(self.dcz_entries[version]):
-            entry = self.get_entry(i,version)
-            if entry[0]==resource:
-                # found!
-                index = i
-                entry[2]=len(bin)
-                entry[3]=format
-                entry[4]=chksum
-                break
-        else:
-            raise DCZNoResourceError
+        chksum = self.checksum(bin)
+
+        if resource in self.logs and len(bin)>self.logs[resource]:
+            # doesn't fit in its slot
+            raise ValueError
+
+        # work on a copy: the indexed entry is updated by save_entry only on success
+        entry = self.find_entry(resource,version)[:]
+        entry[2]=len(bin)
+        entry[3]=format
+        entry[4]=chksum
 
         if entry[5]:
             #encrypt
-            __vmctrl(3,0,chksum,bin)
+            self.encrypt_data(chksum,bin)
             entry[6]=1
-        return self.save_entry(entry,bin,new_version)
+        return entry, bin
+
+    def open_writer(self,resource,version=None,format="bin"):
+        """
+.. method:: open_writer(resource,version=None,format="bin")
+
+    Return a :class:`DCZWriter` to save the binary representation of :samp:`resource` in chunks, without keeping it entirely in memory.
+    :samp:`version` and :samp:`format` have the same meaning as in :method:`save_resource`. The DCZ is updated only when the writer is closed.
+
+    Encrypted resources can only be encrypted as a whole and can't be streamed: :samp:`ValueError` is raised for them and for resources in append mode.
+
+    If no resource with name :samp:`resource` can be found, :samp:`DCZNoResourceError` is raised.
+
+        """
+        self.lock_read()
+        try:
+            self.begin("open_writer")
+            version, new_version = self.handle_new_version(version)
+            if len(format)>4:
+                raise ValueError
+            entry = self.find_entry(resource,version)[:]
+            if entry[5] or entry[0] in self.logs:
+                raise ValueError
+            entry[3]=format
+            return DCZWriter(self,entry,new_version)
+        finally:
+            self.end()
+            self.unlock_read()
 
     def get_header(self,version=None):
         """
@@ -382,6 +1927,8 @@ DCZ class
         version = self.handle_version(version,self.latest_version)
         addr = self.addr[version]
         hbuf = self.get_zone(addr,HEADER_SIZE)
+        if self.counters is not None:
+            self.count("decodes")
         return _decode_header(hbuf)
 
     def get_entry(self,i,version=None):
@@ -408,16 +1955,19 @@ DCZ class
         addr = self.addr[version]
         addr= addr+HEADER_SIZE+ENTRY_SIZE*i
         hbuf = self.get_zone(addr,ENTRY_SIZE)
+        if self.counters is not None:
+            self.count("decodes")
         ee = _decode_entry(hbuf)
         ee.append(i)
         ee.append(version)
         return ee
 
-    def load_entry(self,entry):
+    def load_entry(self,entry,buf=None):
         """
-.. method:: load_entry(entry)
+.. method:: load_entry(entry,buf=None)
     
     Return the raw binary data of the resource in :samp:`entry` as present on the flash (without decryption). An :samp:`entry` retrieved with :method:`get_entry` must be given in order to identify the resource.
+    If :samp:`buf` is given, data is read into it instead of a newly allocated bytearray. :samp:`buf` must be at least as big as the resource.
 
     This method is exposed for custom usage of DCZ, but :method:`load_resource` is recommended.
 
@@ -425,8 +1975,85 @@ DCZ class
         version = entry[-1]
         resource_addr = entry[1][version]
         sz = entry[2]
-        return self.get_zone(resource_addr,sz)
-
+        return self.get_zone(resource_addr,sz,buf)
+
+
+    def scan_log(self,entry):
+        # read the whole slot of entry with a single flash read and return it, together with the records appended to it
+        # as a list of [position, size, checksum] and the position of the free space
+        end = self.logs[entry[0]]
+        slot = self.get_zone(entry[1][entry[-1]],end)
+        pos = (entry[2]+3)&~3
+        records = []
+        while pos+LOG_HEADER_SIZE<=end:
+            if slot[pos]!=0xdc or slot[pos+1]!=0x7a:
+                for i in range(pos,pos+LOG_HEADER_SIZE):
+                    if slot[i]!=0xff:
+                        # not erased, nothing more can be appended
+                        return slot, records, end
+                break
+            size = _get_int(slot,pos+2,2)
+            if pos+LOG_HEADER_SIZE+size>end:
+                return slot, records, end
+            # records appended to a previous value of the resource are stale
+            if _get_int(slot,pos+4,4)==entry[4]:
+                records.append([pos+LOG_HEADER_SIZE,size,_get_int(slot,pos+8,4)])
+            pos = (pos+LOG_HEADER_SIZE+size+3)&~3
+        return slot, records, pos
+
+    def read_log(self,entry):
+        # return the latest valid value of entry in append mode and its checksum
+        slot, records, free = self.scan_log(entry)
+        i = len(records)-1
+        while i>=0:
+            pos, size, chk = records[i]
+            buf = slot[pos:pos+size]
+            if self.checksum(buf)==chk:
+                return buf, chk
+            # torn or corrupted record, try the previous one
+            i-=1
+        return slot[0:entry[2]], entry[4]
+
+    def append_log(self,entry,bin,version,new_version):
+        # append bin to the slot of entry as a record, return False if it must be saved as usual
+        if entry[0] not in self.logs or entry[5] or new_version!=self.dcz_version[version] or len(bin)>0xffff:
+            return False
+        stored = self.find_entry(entry[0],version)
+        if stored[3]!=entry[3]:
+            return False
+        slot, records, free = self.scan_log(stored)
+        if free+LOG_HEADER_SIZE+len(bin)>self.logs[entry[0]]:
+            return False
+        # record header: magic, size, checksum of the stored resource, checksum of bin
+        rec = bytearray(LOG_HEADER_SIZE+len(bin))
+        rec[0]=0xdc
+        rec[1]=0x7a
+        _put_int(rec,2,len(bin),2)
+        _put_int(rec,4,stored[4],4)
+        _put_int(rec,8,entry[4],4)
+        rec[LOG_HEADER_SIZE:]=bin
+        addr = stored[1][version]
+        if self.flash.programmable:
+            slot = None
+            self.program_zone(addr+free,rec)
+        else:
+            # writing erases: rewrite the whole slot, base and previous records included
+            slot[free:free+len(rec)]=rec
+            rec = None
+            self.set_zone(addr,slot)
+        self.cache_drop(version,entry[0])
+        return True
+
+    def slot_data(self,entry,bin):
+        # bin followed by the erased rest of the slot for resources in append mode, bin otherwise
+        if entry[0] not in self.logs:
+            return bin
+        size = self.logs[entry[0]]
+        if len(bin)>size:
+            raise ValueError
+        slot = bytearray(b"\xff")*size
+        slot[0:len(bin)]=bin
+        return slot
 
     def save_entry(self,entry,bin,new_version=None):
         """
@@ -439,35 +2066,67 @@ DCZ class
     Return the saved resource address and the address of the modified DCZ
 
         """
+        self.lock_write()
+        try:
+            return self.store_entry(entry,bin,new_version)
+        finally:
+            self.unlock_write()
+
+    def store_entry(self,entry,bin,new_version=None):
+        # save_entry without locking
         version = entry[-1]
-        index = entry[-2]
         if new_version is None:
             new_version=version
             version = self.handle_version(version,version)
         else:
             version = self.handle_version(new_version,version)
         resource_addr = entry[1][version]
-        self.set_zone(resource_addr,bin)
+        self.set_zone(resource_addr,self.slot_data(entry,bin))
         # free some mem
         bin=None
+        addr = self.update_dcz([entry],version,new_version)
+        return resource_addr, addr
+
+    def update_dcz(self,entries,version,new_version):
+        # write the given entries to the DCZ identified by version with a single table rewrite
+        self.load_dcz(version)
         # load dcz
         addr = self.addr[version]
-        dczbin,chksum = self.get_dcz(version)
-        pos = addr+HEADER_SIZE+index*ENTRY_SIZE
+        dczbin = self.get_zone(addr,HEADER_SIZE+self.dcz_entries[version]*ENTRY_SIZE)
         # modify dcz
-        _encode_entry(dczbin,index,entry)
+        if self.counters is not None:
+            self.count("encodes",len(entries)+1)
+            self.count("checksum_bytes",len(dczbin)-4)
+        for entry in entries:
+            _encode_entry(dczbin,entry[-2],entry)
         _encode_header(dczbin,len(dczbin),new_version,self.dcz_entries[version])
         # save dcz
         self.set_zone(addr,dczbin)
-        # reload dcz
-        size0, version0, entries0, chksum0, cardinality = self.get_header(version)
+        # saved resources must be loaded again
+        for entry in entries:
+            self.cache_drop(version,entry[0])
+        # update index with the entries as stored in the dcz
+        if self.indexed:
+            for entry in entries:
+                index = entry[-2]
+                pos = HEADER_SIZE+index*ENTRY_SIZE
+                if self.counters is not None:
+                    self.count("decodes")
+                ee = _decode_entry(dczbin[pos:pos+ENTRY_SIZE])
+                ee.append(index)
+                ee.append(version)
+                self.dcz_table[version][index]=ee
+                self.dcz_index[version][ee[0]]=ee
+        # reload dcz header from the saved table
+        size0, version0, entries0, chksum0, cardinality = _decode_header(dczbin)
         self.dcz_size[version]=size0
         self.dcz_version[version]=version0
         self.dcz_chksum[version]=chksum0
         self.dcz_entries[version]=entries0
+        self.dcz_valid[version]=True
         if new_version>self.latest_version:
             self.latest_version=new_version
-        return resource_addr, addr
+        return addr
 
     def search_entry(self,resource,version=None):
         """
@@ -484,21 +2143,136 @@ DCZ class
     If no resource exists, :samp:`DCZNoResourceError` is raised
     
 
+        """
+        self.lock_read()
+        try:
+            version = self.handle_version(version,self.latest_version)
+            entry = self.find_entry(resource,version)
+            return entry[1][version],entry[2],entry[3],entry[4],entry[6]
+        finally:
+            self.unlock_read()
+
+    def find_entry(self,resource,version=None):
+        """
+.. method:: find_entry(resource,version=None)
+
+    Return the entry of the resource named :samp:`resource` in the DCZ identified by :samp:`version` (see :method:`get_entry`).
+    If the DCZ instance keeps an index, the lookup is done on the in-RAM index built by :method:`init` and no flash read is performed.
+    Otherwise the DCZ table is read and searched natively, and only the matching entry is decoded.
+
+    The returned entry may be shared with the index and must not be modified.
+
+    If no resource exists, :samp:`DCZNoResourceError` is raised
+
         """
         version = self.handle_version(version,self.latest_version)
-        for i in range(self.dcz_entries[version]):
-            entry = self.get_entry(i,version)
-            if entry[0]==resource:
-                return entry[1][version],entry[2],entry[3],entry[4],entry[6]
-        else:
+        # validate the DCZ on first access after a lazy init, with or without index
+        self.load_dcz(version)
+        if self.indexed:
+            index = self.dcz_index[version]
+            if resource not in index:
+                raise DCZNoResourceError
+            return index[resource]
+        dczbin = self.get_zone(self.addr[version],HEADER_SIZE+self.dcz_entries[version]*ENTRY_SIZE)
+        return self.search_table(dczbin,resource,version)
+
+    def find_entries(self,resources,version=None):
+        # find_entry for many resources, reading the DCZ table at most once
+        version = self.handle_version(version,self.latest_version)
+        entries = []
+        if self.indexed:
+            for resource in resources:
+                entries.append(self.find_entry(resource,version))
+            return entries
+        self.load_dcz(version)
+        dczbin = self.get_zone(self.addr[version],HEADER_SIZE+self.dcz_entries[version]*ENTRY_SIZE)
+        for resource in resources:
+            entries.append(self.search_table(dczbin,resource,version))
+        return entries
+
+    def search_table(self,dczbin,resource,version):
+        # natively search resource in the binary table dczbin and decode its entry
+        i = _find_entry(dczbin,resource)
+        if i<0:
             raise DCZNoResourceError
+        pos = HEADER_SIZE+i*ENTRY_SIZE
+        if self.counters is not None:
+            self.count("decodes")
+        entry = _decode_entry(dczbin[pos:pos+ENTRY_SIZE])
+        entry.append(i)
+        entry.append(version)
+        return entry
+
+    def load_dcz(self,version=None):
+        # read, validate and index a DCZ skipped by a lazy init
+        # readers may get here together holding only the read lock: load_lock lets one of them load the DCZ,
+        # and dcz_valid is set last since the others test it without the lock
+        version = self.handle_version(version,self.latest_version)
+        if self.dcz_valid[version] is not None:
+            return
+        if self.load_lock is not None:
+            self.load_lock.acquire()
+        try:
+            if self.dcz_valid[version] is not None:
+                return
+            header, chksum, table = self.read_dcz(version,self.indexed)
+            self.dcz_table[version]=table
+            self.dcz_index[version]=self.index_table(table) if table is not None else None
+            self.dcz_valid[version]=header[3]==chksum
+        finally:
+            if self.load_lock is not None:
+                self.load_lock.release()
+
+    def validate_all(self):
+        """
+.. method:: validate_all()
+
+    Validate all the DCZs that have not been validated yet after a lazy :meth:`init`. Return the list of validity flags of all the DCZs.
+
+        """
+        self.lock_read()
+        try:
+            for i in range(self.modulo):
+                self.load_dcz(i)
+            return self.dcz_valid
+        finally:
+            self.unlock_read()
+
+    def index_table(self,table):
+        # map each resource name of a decoded DCZ to its entry
+        index = {}
+        for entry in table:
+            index[entry[0]]=entry
+        return index
+
+    def read_dcz(self,version=None,decode=True):
+        # read the header and then the whole table in one go
+        version = self.handle_version(version,self.latest_version)
+        addr = self.addr[version]
+        hbuf = self.get_zone(addr,HEADER_SIZE)
+        entries = _decode_header(hbuf)[2]
+        dczbin = self.get_zone(addr,HEADER_SIZE+entries*ENTRY_SIZE)
+        if decode:
+            if self.counters is not None:
+                self.count("decodes")
+                self.count("checksum_bytes",len(dczbin)-4)
+            return _decode_table(dczbin,version)
+        return _decode_header(dczbin), self.checksum(dczbin[4:]), None
+
+    def get_table(self,version=None):
+        # list of all the entries of a DCZ, from RAM if indexed
+        version = self.handle_version(version,self.latest_version)
+        if self.indexed:
+            self.load_dcz(version)
+            return self.dcz_table[version]
+        return self.read_dcz(version)[2]
 
     def get_dcz(self,version=None):
         version = self.handle_version(version,self.latest_version)
         addr = self.addr[version]
         sz = HEADER_SIZE+self.dcz_entries[version]*ENTRY_SIZE
         dczbin = self.get_zone(addr,sz)
-        chksum = fletcher32(dczbin[4:])
+        chksum = self.checksum(dczbin[4:])
         return dczbin, chksum
 
     def check_dcz(self,version=None):
@@ -509,67 +2283,237 @@ DCZ class
         """
         version = self.handle_version(version,self.latest_version)
         dczbin, chksum = self.get_dcz(version)
-        size0, version0, entries0, chksum0, cardinality = self.get_header(version)
+        size0, version0, entries0, chksum0, cardinality = _decode_header(dczbin)
         return chksum0==chksum
 
     def is_valid_dcz(self,version=None):
         """
 .. method:: is_valid_dcz(version=None)
 
-    Return True if the DCZ identified by :samp:`version` is valid. It looks up validity from the checks done after init.
+    Return True if the DCZ identified by :samp:`version` is valid. It looks up validity from the checks done after init,
+    validating the DCZ if a lazy init skipped it.
         """
-        version = self.handle_version(version,self.latest_version)
-        return self.dcz_valid[version]
+        self.lock_read()
+        try:
+            version = self.handle_version(version,self.latest_version)
+            self.load_dcz(version)
+            return self.dcz_valid[version]
+        finally:
+            self.unlock_read()
+
+    def verify(self,decrypt=True):
+        """
+.. method:: verify(decrypt=True)
+
+    Read again all the DCZs and all their resources from the storage, check all the checksums and return a report as a dict with:
+
+        * :samp:`"latest"`, the highest version of the valid DCZs, or -1 if no DCZ is valid
+        * :samp:`"zones"`, a list with a dict for each DCZ in :samp:`mapping` order, with the DCZ :samp:`"version"`, the :samp:`"valid"` flag of its table,
+          the list of :samp:`"corrupted"` resource names, the list of :samp:`"unfinalized"` resource names, marked for encryption but still in the clear (see :meth:`finalize`),
+          and the list of :samp:`"encrypted"` resource names that were not checked because :samp:`decrypt` is :samp:`False`
+
+    Resources of invalid DCZs are not checked. The in-RAM state of the DCZ instance is not used nor modified, therefore :samp:`verify` can audit
+    a flash dump loaded in a :class:`RamFlash`. Encrypted resources can only be decrypted by the device that encrypted them: to audit the dump of another device
+    set :samp:`decrypt` to :samp:`False`, so that its encrypted resources are listed as :samp:`"encrypted"` instead of being reported as corrupted.
+
+        """
+        self.lock_read()
+        try:
+            self.begin("verify")
+            latest = -1
+            zones = []
+            for i in range(self.modulo):
+                header, chksum, table = self.read_dcz(i)
+                zone = {
+                    "version":header[1],
+                    "valid":header[3]==chksum,
+                    "corrupted":[],
+                    "unfinalized":[],
+                    "encrypted":[]
+                }
+                zones.append(zone)
+                if not zone["valid"]:
+                    continue
+                if header[1]>latest:
+                    latest = header[1]
+                for entry in table:
+                    if entry[5] and entry[6] and not decrypt:
+                        zone["encrypted"].append(entry[0])
+                        continue
+                    buf = self.load_entry(entry)
+                    if entry[5]:
+                        if entry[6]:
+                            self.decrypt_data(entry[4],buf)
+                        else:
+                            zone["unfinalized"].append(entry[0])
+                    if self.checksum(buf)!=entry[4]:
+                        zone["corrupted"].append(entry[0])
+                    buf = None
+            return {"latest":latest,"zones":zones}
+        finally:
+            self.end()
+            self.unlock_read()
 
     def get_zone(self,addr,size,buf=None):
+        if self.counters is not None:
+            self.count("reads")
+            self.count("read_bytes",size)
         if buf is None:
             buf=bytearray(size)
-        zonebin = __read_flash(addr,size,buf)
+        zonebin = self.flash.read(addr,size,buf)
         return zonebin
 
+    def get_sectors(self,addr,size):
+        # read the whole sectors containing size bytes at addr, to write them back modified
+        sector = self.flash.sector
+        zone = addr-addr%sector
+        end = addr+size
+        if end%sector:
+            end+=sector-end%sector
+        return zone, self.get_zone(zone,end-zone)
+
     def set_zone(self,addr,data):
-        __write_flash(addr,data)
+        if self.counters is not None:
+            self.count("writes")
+            self.count("write_bytes",len(data))
+        self.flash.write(addr,data)
+
+    def program_zone(self,addr,data):
+        # write to erased flash, only for programmable backends
+        if self.counters is not None:
+            self.count("writes")
+            self.count("write_bytes",len(data))
+        self.flash.program(addr,data)
+
+    def lock_read(self):
+        if self.rwlock is not None:
+            self.rwlock.acquire_read()
+
+    def unlock_read(self):
+        if self.rwlock is not None:
+            self.rwlock.release_read()
+
+    def lock_write(self):
+        if self.rwlock is not None:
+            self.rwlock.acquire_write()
+
+    def unlock_write(self):
+        if self.rwlock is not None:
+            self.rwlock.release_write()
+
+    def checksum(self,buf):
+        if self.counters is not None:
+            self.count("checksum_bytes",len(buf))
+        return fletcher32(buf)
+
+    def encrypt_data(self,chksum,buf):
+        if self.counters is not None:
+            self.count("encrypts")
+        self.flash.encrypt(chksum,buf)
+
+    def decrypt_data(self,chksum,buf):
+        if self.counters is not None:
+            self.count("decrypts")
+        self.flash.decrypt(chksum,buf)
+
+    def begin(self,op,calls=1):
+        # following counts are attributed to the public method op, until end is called
+        if self.counters is not None:
+            self.op = op
+            self.count("calls",calls)
+
+    def end(self):
+        # back to the counts of methods called directly
+        self.op = "other"
+
+    def count(self,what,n=1):
+        if self.op not in self.counters:
+            cc = {}
+            for k in STATS_COUNTERS:
+                cc[k]=0
+            self.counters[self.op]=cc
+        self.counters[self.op][what]+=n
+
+    def stats(self):
+        """
+.. method:: stats()
+
+    Return a dict mapping the names of the public methods called so far to a dict of counters. The counters are:
+
+        * :samp:`calls`, the number of calls to the method
+        * :samp:`reads` and :samp:`read_bytes`, the number of flash reads and read bytes
+        * :samp:`writes` and :samp:`write_bytes`, the number of flash writes and written bytes
+        * :samp:`decodes` and :samp:`encodes`, the number of native calls decoding and encoding DCZ headers and entries
+        * :samp:`checksum_bytes`, the number of checksummed bytes
+        * :samp:`encrypts` and :samp:`decrypts`, the number of encryptions and decryptions
+        * :samp:`serializer_ms`, the time spent in serializers in milliseconds
+
+    Operations done by readers and writers are attributed to :meth:`open_resource` and :meth:`open_writer`, operations done by
+    other methods called directly are attributed to :samp:`other`.
+    Counters are only available if the DCZ instance has been created with :samp:`instrument=True`, otherwise None is returned.
+
+        """
+        return self.counters
+
+    def reset_stats(self):
+        """
+.. method:: reset_stats()
+
+    Set all the counters to zero.
 
-    def dump(self,version=None,entries=False):
         """
-.. method:: dump(version=None,entries=False)
+        if self.counters is not None:
+            self.counters = {}
+
+    def dump(self,version=None,entries=False,printer=print):
+        """
+.. method:: dump(version=None,entries=False,printer=print)
 
     Print information about DCZs. If :samp:`version` is not given, all DCZs are printed, otherwise only the specific :samp:`version`.
     If :samp:`entries` is given, additional information about each entry is given.
+    Each line is output by calling :samp:`printer` with the same arguments of :samp:`print`: a different function can redirect or discard the output.
 
         """
-        ll = self.latest_version%self.modulo
-        if version is not None:
-            vi=version%self.modulo
-            ve=vi+1
-        else:
-            version = self.handle_version(version,self.latest_version)
-            vi=0
-            ve=self.modulo
-        for v in range(vi,ve):
-            print("DCZ",v,"@",hex(self.addr[v]))
-            print("==========")
-            print("| Version:  ",self.dcz_version[v])
-            print("| Entries:  ",self.dcz_entries[v])
-            print("| Size:     ",self.dcz_size[v])
-            print("| Checksum: ",hex(self.dcz_chksum[v]))
-            print("| Valid:    ",self.dcz_valid[v])
-            print("| Zones:    ",self.cardinality)
-            print("| Current:  ",str(ll==v))
-            if not self.dcz_valid[v] or not entries:
-                continue
-            for j in range(self.dcz_entries[v]):
-                entry = self.get_entry(j,v)
-                print("|")
-                print("|----> Entry:     ",j)
-                print("|      Resource:  ",entry[0])
-                print("|      Address:   ",hex(entry[1][v]))
-                print("|      Size:      ",entry[2])
-                print("|      Format:    ",entry[3])
-                print("|      Checksum:  ",hex(entry[4]))
-                print("|      Encryption:",entry[5])
-                print("|      Encrypted: ",entry[6])
-            print("----------")
+        self.lock_read()
+        try:
+            self.begin("dump")
+            ll = self.latest_version%self.modulo
+            if version is not None:
+                vi=version%self.modulo
+                ve=vi+1
+            else:
+                version = self.handle_version(version,self.latest_version)
+                vi=0
+                ve=self.modulo
+            for v in range(vi,ve):
+                self.load_dcz(v)
+                printer("DCZ",v,"@",hex(self.addr[v]))
+                printer("==========")
+                printer("| Version:  ",self.dcz_version[v])
+                printer("| Entries:  ",self.dcz_entries[v])
+                printer("| Size:     ",self.dcz_size[v])
+                printer("| Checksum: ",hex(self.dcz_chksum[v]))
+                printer("| Valid:    ",self.dcz_valid[v])
+                printer("| Zones:    ",self.cardinality)
+                printer("| Current:  ",str(ll==v))
+                if not self.dcz_valid[v] or not entries:
+                    continue
+                table = self.get_table(v)
+                for j in range(self.dcz_entries[v]):
+                    entry = table[j]
+                    printer("|")
+                    printer("|----> Entry:     ",j)
+                    printer("|      Resource:  ",entry[0])
+                    printer("|      Address:   ",hex(entry[1][v]))
+                    printer("|      Size:      ",entry[2])
+                    printer("|      Format:    ",entry[3])
+                    printer("|      Checksum:  ",hex(entry[4]))
+                    printer("|      Encryption:",entry[5])
+                    printer("|      Encrypted: ",entry[6])
+                printer("----------")
+        finally:
+            self.end()
+            self.unlock_read()
 
     def versions(self):
         """
@@ -587,11 +2531,15 @@ DCZ class
         Return the list of resource names
 
         """
-        res = [None]*self.dcz_entries[0]
-        for i in range(self.dcz_entries[0]):
-            entry = self.get_entry(i,0)
-            res[i]=entry[0]
-        return res
+        self.lock_read()
+        try:
+            table = self.get_table(0)
+            res = [None]*self.dcz_entries[0]
+            for i in range(self.dcz_entries[0]):
+                res[i]=table[i][0]
+            return res
+        finally:
+            self.unlock_read()
 
 
     def next_version(self):
@@ -603,3 +2551,377 @@ DCZ class
         """
         return self.latest_version+1
 
+
+class DCZScrubber():
+    """
+=================
+DCZScrubber class
+=================
+
+.. class:: DCZScrubber(dcz,chunk=256,pause=20,period=3600000,callback=None)
+
+    A background verifier for the DCZ instance :samp:`dcz`. Once started, it periodically checks the checksum of every DCZ table and of every resource,
+    reading at most :samp:`chunk` bytes at a time and sleeping :samp:`pause` milliseconds between chunks, so that flash and CPU are never taken for long.
+    A new verification pass starts :samp:`period` milliseconds after the end of the previous one.
+
+    If given, :samp:`callback` is called as :samp:`callback(zone, resource)` for each corruption found, where :samp:`zone` is the index of the DCZ and
+    :samp:`resource` is the name of the corrupted resource, or None if the DCZ table itself is corrupted. ::
+
+        def corrupted(zone,resource):
+            print("Corruption in DCZ",zone,resource)
+
+        sc = dcz.DCZScrubber(dc,callback=corrupted)
+        sc.start()
+
+    Encrypted resources can only be decrypted as a whole, therefore they are loaded entirely in memory to be checked.
+    Empty resources are intact if their checksum is the one of empty data.
+
+    The DCZ instance should be created with :samp:`threadsafe=True`: chunks are read holding the DCZ lock for reading and before reporting a corruption,
+    the DCZ or resource is checked again holding the lock for the whole check, so that resources saved while being verified are not reported.
+
+    """
+    def __init__(self,dcz,chunk=256,pause=20,period=3600000,callback=None):
+        self.dcz = dcz
+        self.buf = bytearray(chunk)
+        self.pause = pause
+        self.period = period
+        self.callback = callback
+        self.running = False
+        self.aborted = False
+        # incremented at each start: threads of previous starts end when they see it changed
+        self.generation = 0
+        self.passes = 0
+        self.checked = 0
+        self.errors = 0
+        self.first_error = None
+
+    def start(self):
+        """
+.. method:: start()
+
+        Start verifying in a low priority thread.
+
+        """
+        if self.running:
+            return
+        self.running = True
+        self.aborted = False
+        self.generation+=1
+        thread(self.run,self.generation,prio=PRIO_LOWEST)
+
+    def stop(self):
+        """
+.. method:: stop()
+
+        Stop verifying. The thread ends as soon as the DCZ or resource being verified has been checked.
+
+        """
+        self.running = False
+        self.aborted = True
+
+    def run(self,generation):
+        while self.running and generation==self.generation:
+            self.scrub_pass(generation)
+            if self.running and generation==self.generation:
+                sleep(self.period)
+
+    def stopped(self,generation):
+        # the pass must end: stop was called, or start was called again and a new thread took over
+        return self.aborted or (generation is not None and generation!=self.generation)
+
+    def status(self):
+        """
+.. method:: status()
+
+        Return a dict with:
+
+            * :samp:`running`, True if the scrubber is running
+            * :samp:`passes`, the number of complete verification passes
+            * :samp:`checked`, the number of checked DCZs and resources
+            * :samp:`errors`, the number of corruptions found
+            * :samp:`first_error`, a tuple with zone and resource of the first corruption found, or None
+
+        """
+        return {
+            "running":self.running,
+            "passes":self.passes,
+            "checked":self.checked,
+            "errors":self.errors,
+            "first_error":self.first_error
+        }
+
+    def scrub(self):
+        """
+.. method:: scrub()
+
+        Do a complete verification pass in the calling thread and return the number of corruptions found.
+
+        """
+        return self.scrub_pass(None)
+
+    def scrub_pass(self,generation):
+        dc = self.dcz
+        errors = 0
+        for zone in range(dc.modulo):
+            if self.stopped(generation):
+                return errors
+            if not self.check_table(zone) and not self.verify(zone,None):
+                errors+=1
+                self.report(zone,None)
+                continue
+            dc.lock_read()
+            try:
+                table = dc.get_table(zone)
+            finally:
+                dc.unlock_read()
+            for entry in table:
+                if self.stopped(generation):
+                    return errors
+                if not self.check_entry(entry) and not self.verify(zone,entry[0]):
+                    errors+=1
+                    self.report(zone,entry[0])
+        self.passes+=1
+        return errors
+
+    def report(self,zone,resource):
+        self.errors+=1
+        if self.first_error is None:
+            self.first_error = (zone,resource)
+        if self.callback is not None:
+            self.callback(zone,resource)
+
+    def verify(self,zone,resource):
+        # check again in one go while holding the lock, to rule out resources saved while they were being checked
+        dc = self.dcz
+        dc.lock_read()
+        try:
+            if resource is None:
+                return self.check_table(zone,True)
+            return self.check_entry(dc.find_entry(resource,zone),True)
+        finally:
+            dc.unlock_read()
+
+    def read_chunk(self,addr,n,locked):
+        # read a chunk into self.buf, pausing between chunks unless the lock is already held
+        dc = self.dcz
+        if locked:
+            dc.get_zone(addr,n,self.buf)
+            return
+        dc.lock_read()
+        try:
+            dc.get_zone(addr,n,self.buf)
+        finally:
+            dc.unlock_read()
+        sleep(self.pause)
+
+    def check_chunks(self,addr,size,chksum,locked):
+        ck = Fletcher32()
+        end = addr+size
+        while addr<end:
+            n = end-addr
+            if n>len(self.buf):
+                n = len(self.buf)
+            self.read_chunk(addr,n,locked)
+            ck.update(self.buf,n)
+            addr+=n
+        return ck.digest()==chksum
+
+    def check_table(self,zone,locked=False):
+        # checksum the table, skipping the stored checksum
+        dc = self.dcz
+        self.checked+=1
+        self.read_chunk(dc.addr[zone],HEADER_SIZE,locked)
+        header = _decode_header(self.buf)
+        return self.check_chunks(dc.addr[zone]+4,HEADER_SIZE-4+header[2]*ENTRY_SIZE,header[3],locked)
+
+    def check_entry(self,entry,locked=False):
+        dc = self.dcz
+        self.checked+=1
+        if not entry[2]:
+            # nothing to read nor to decrypt
+            return dc.checksum(self.buf[:0])==entry[4]
+        if entry[5] and entry[6]:
+            if not locked:
+                dc.lock_read()
+            try:
+                buf = dc.load_entry(entry)
+            finally:
+                if not locked:
+                    dc.unlock_read()
+            dc.decrypt_data(entry[4],buf)
+            res = dc.checksum(buf)==entry[4]
+            buf = None
+            if not locked:
+                sleep(self.pause)
+            return res
+        return self.check_chunks(entry[1][entry[-1]],entry[2],entry[4],locked)
+
+
+def kv_dumps(obj):
+    """
+.. function:: kv_dumps(obj)
+
+    Encode the dict :samp:`obj` in the "kv" format and return it as a bytearray. Keys must be strings of at most 255 bytes,
+    values must be strings of at most 65535 bytes or 32 bit integers, otherwise :samp:`TypeError` or :samp:`ValueError` are raised.
+
+    The "kv" format is made of the number of items (16 bits) followed by each item as: the key length (8 bits), the key, the value type (0 for integers, 1 for strings)
+    and the value, as a 32 bit integer or as the string length (16 bits) followed by the string. All numbers are little endian.
+
+    """
+    items = []
+    for k in obj:
+        items.append(k)
+        items.append(obj[k])
+    return _kv_encode(items)
+
+def kv_loads(buf):
+    """
+.. function:: kv_loads(buf)
+
+    Decode :samp:`buf`, in the "kv" format, and return the dict. If :samp:`buf` is malformed, :samp:`ValueError` is raised.
+
+    """
+    return _kv_decode(buf)
+
+def kv_get(buf,key):
+    """
+.. function:: kv_get(buf,key)
+
+    Return the value of :samp:`key` in :samp:`buf`, in the "kv" format, without decoding the other keys, or :samp:`None` if :samp:`key` is missing.
+    If :samp:`buf` is malformed, :samp:`ValueError` is raised.
+
+    """
+    if len(buf)<2:
+        raise ValueError
+    count = _get_int(buf,0,2)
+    done, value = _kv_scan(buf,2,len(buf),key,count)[1:]
+    if value is None and done<count:
+        raise ValueError
+    return value
+
+def lz_compress(data,format="bin"):
+    """
+.. function:: lz_compress(data,format="bin")
+
+    Compress the bytes in :samp:`data`, the binary representation of a resource in :samp:`format`, and return the resulting resource in the "lz" format
+    as a bytearray. If compression does not reduce the size of :samp:`data`, :samp:`None` is returned.
+
+    The "lz" format is made of :samp:`format` (4 bytes, zero padded) and the size of :samp:`data` (32 bits, little endian), followed by the compressed data.
+    The codec is a simple LZ77 with a window of 1024 bytes, implemented natively: it works best on text like JSON and PEM certificates.
+
+    """
+    if len(format)>4:
+        raise ValueError
+    if len(data)<=LZ_HEADER_SIZE:
+        return None
+    dst = bytearray(len(data)-1)
+    n = _lz_compress(data,dst,LZ_HEADER_SIZE,bytearray(LZ_WORK_SIZE))
+    if n<0:
+        return None
+    _put_str(dst,0,format)
+    _put_int(dst,4,len(data),4)
+    return dst[:n]
+
+def lz_decompress(buf):
+    """
+.. function:: lz_decompress(buf)
+
+    Decompress :samp:`buf`, a resource in the "lz" format (see :func:`lz_compress`), and return a tuple with its original format and data.
+    If :samp:`buf` is truncated or corrupted, :samp:`ValueError` is raised.
+
+    """
+    if len(buf)<LZ_HEADER_SIZE:
+        raise ValueError
+    dst = bytearray(_get_int(buf,4,4))
+    if _lz_decompress(buf,LZ_HEADER_SIZE,dst)!=len(dst):
+        raise ValueError
+    return _get_str(buf,0,4), dst
+
+def build_dcz(mapping,resources,version=0):
+    """
+.. function:: build_dcz(mapping,resources,version=0)
+
+    Build the DCZs at the addresses in :samp:`mapping` together with their resources, without writing them.
+    :samp:`resources` and :samp:`version` have the same meaning as in :func:`format_dcz` and mirror the :samp:`provisioning` and :samp:`dcz` sections of :samp:`dcz.yml`.
+
+    Return a sparse image as a list of :samp:`[address, data]` pairs, with the resources of each DCZ followed by its table. The image can be
+    written with :func:`format_dcz`, merged into a flat image with :func:`build_image` or sent to a programmer to be flashed.
+
+    """
+    n = len(resources)
+    blobs = []
+    for i in range(len(mapping)):
+        dczbin = bytearray(HEADER_SIZE+n*ENTRY_SIZE)
+        # cardinality is not written by _encode_header
+        dczbin[14]=len(mapping)
+        for j in range(n):
+            name, addrs, data, fmt, enc = resources[j]
+            raddrs = [0]*8
+            for k in range(len(addrs)):
+                raddrs[k]=addrs[k]
+            # encryption request is not written by _encode_entry
+            dczbin[HEADER_SIZE+j*ENTRY_SIZE+60]=enc
+            _encode_entry(dczbin,j,[name,raddrs,len(data),fmt,fletcher32(data),enc,0])
+            blobs.append([addrs[i],data])
+        _encode_header(dczbin,len(dczbin),version,n)
+        blobs.append([mapping[i],dczbin])
+    return blobs
+
+def build_image(blobs,base,size):
+    """
+.. function:: build_image(blobs,base,size)
+
+    Merge the sparse image :samp:`blobs` returned by :func:`build_dcz` into a flat image of :samp:`size` bytes starting at address :samp:`base`.
+    Bytes not covered by :samp:`blobs` are set to 0xff, as in erased flash. If a blob does not fit in the image, :samp:`ValueError` is raised.
+
+    """
+    img = bytearray(b"\xff")*size
+    for addr, data in blobs:
+        pos = addr-base
+        if pos<0 or pos+len(data)>size:
+            raise ValueError
+        img[pos:pos+len(data)]=data
+    return img
+
+def format_dcz(flash,mapping,resources,version=0):
+    """
+.. function:: format_dcz(flash,mapping,resources,version=0)
+
+    Write new DCZs at the addresses in :samp:`mapping` and their resources to the storage backend :samp:`flash` (see :class:`Flash`).
+    This is usually done by the Zerynth toolchain at provisioning time, but can be useful to prepare DCZs in simulated storages.
+
+    :samp:`resources` is a list of resources, each one given as a list with:
+
+        * the name of the resource
+        * the list of the addresses of the resource, one for each DCZ
+        * the binary data of the resource
+        * the format of the resource
+        * a flag to 1 if encryption is required
+
+    All the DCZs are written with version :samp:`version`, resources are written in the clear (see :meth:`DCZ.finalize`).
+    Since writes erase whole sectors, DCZs and resources sharing sectors are merged with :func:`build_image` and written together.
+
+    """
+    blobs = build_dcz(mapping,resources,version)
+    # sort by address
+    for i in range(1,len(blobs)):
+        blob = blobs[i]
+        j = i
+        while j>0 and blobs[j-1][0]>blob[0]:
+            blobs[j]=blobs[j-1]
+            j-=1
+        blobs[j]=blob
+    sector = flash.sector
+    i = 0
+    while i<len(blobs):
+        start = blobs[i][0]-blobs[i][0]%sector
+        end = blobs[i][0]+len(blobs[i][1])
+        j = i+1
+        while j<len(blobs) and blobs[j][0]<end+(sector-end%sector)%sector:
+            end = max(end,blobs[j][0]+len(blobs[j][1]))
+            j+=1
+        if j==i+1:
+            flash.write(blobs[i][0],blobs[i][1])
+        else:
+            flash.write(start,build_image(blobs[i:j],start,end-start))
+        i = j
@@ -0,0 +1,107 @@
+################################################################################
+# DCZ Benchmark
+#
+# Created by Zerynth Team 2019 CC
+# Authors: D. Mazzei, G. Baldi,
+###############################################################################
+
+import streams
+import json
+import timers
+# import the DCZ module
+from dcz import dcz
+
+streams.serial()
+
+# the configurations to measure
+ENTRIES = [1,8,64]
+REPLICAS = [1,2,8]
+SIZES = [64,1024,16384,65536]
+
+# configurations needing more simulated flash than this are skipped and reported as such:
+# the whole matrix needs tens of MB and is run on a PC by host/dcz_bench.py
+MAX_FLASH = 96*1024
+
+# simulated flash: sector size, cost per read byte, per written byte and per erased sector (in us)
+# small sectors keep the simulated flash (and the RAM it takes) close to the size of the data
+SECTOR = 512
+READ_COST = 0.05
+WRITE_COST = 0.5
+ERASE_COST = 45000
+
+BASE = 0x310000
+
+def slot(size):
+    # round up to whole sectors, so that DCZs and resources never share a sector
+    return ((size+SECTOR-1)//SECTOR)*SECTOR
+
+def report(fl,op,entries,replicas,size,t0):
+    res = fl.stats()
+    res["ms"]=timers.now()-t0
+    res["op"]=op
+    res["entries"]=entries
+    res["replicas"]=replicas
+    res["size"]=size
+    print(json.dumps(res))
+    fl.reset()
+
+def quiet(*args):
+    # discard the output of dump, keeping only the JSON records
+    pass
+
+def bench(entries,replicas,size):
+    fl = dcz.SimFlash(SECTOR,READ_COST,WRITE_COST,ERASE_COST)
+    # place the DCZs first, then the resource slots
+    mapping = []
+    addr = BASE
+    for i in range(replicas):
+        mapping.append(addr)
+        addr+=slot(dcz.HEADER_SIZE+entries*dcz.ENTRY_SIZE)
+    data = bytearray(size)
+    for i in range(size):
+        data[i]=i&0xff
+    resources = []
+    for j in range(entries):
+        addrs = []
+        for i in range(replicas):
+            addrs.append(addr)
+            addr+=slot(size)
+        # the first resource requires encryption, to give finalize some work
+        resources.append(["res"+str(j),addrs,data,"bin",1 if j==0 else 0])
+    dcz.format_dcz(fl,mapping,resources)
+    data = None
+    last = "res"+str(entries-1)
+
+    fl.reset()
+    t0 = timers.now()
+    dc = dcz.DCZ(mapping,flash=fl)
+    report(fl,"init",entries,replicas,size,t0)
+
+    t0 = timers.now()
+    dc.finalize()
+    report(fl,"finalize",entries,replicas,size,t0)
+
+    t0 = timers.now()
+    buf = dc.load_resource(last,check=True)
+    report(fl,"load_resource",entries,replicas,size,t0)
+
+    t0 = timers.now()
+    dc.save_resource(last,buf,version=dc.next_version())
+    report(fl,"save_resource",entries,replicas,size,t0)
+
+    t0 = timers.now()
+    dc.dump(entries=True,printer=quiet)
+    report(fl,"dump",entries,replicas,size,t0)
+
+try:
+    for entries in ENTRIES:
+        for replicas in REPLICAS:
+            for size in SIZES:
+                needed = replicas*(slot(dcz.HEADER_SIZE+entries*dcz.ENTRY_SIZE)+entries*slot(size))
+                if needed>MAX_FLASH:
+                    print(json.dumps({"op":"skipped","entries":entries,"replicas":replicas,"size":size,"needed":needed}))
+                    continue
+                bench(entries,replicas,size)
+    print("Done")
+except Exception as e:
+    print(e)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Run the DCZ benchmark of examples/DCZ_Benchmark on the host, over the whole matrix of configurations.
+
+    python3 dcz_bench.py > bench.jsonl
+
+The operations, the simulated flash and the JSON records are the ones of the example: a record per operation with
+the flash counters of dcz.SimFlash, the cost and the elapsed "ms" (of CPython, only meaningful to compare host runs).
+On the host no configuration is skipped, since the simulated flash is not limited by the RAM of a device.
+Encryption is done by the VM on the devices: here it is replaced by a XOR with the checksum, that costs no flash operation.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import dczhost
+
+ENTRIES = [1,8,64]
+REPLICAS = [1,2,8]
+SIZES = [64,1024,16384,65536]
+
+# same simulated flash of the example, costs in us
+SECTOR = 512
+READ_COST = 0.05
+WRITE_COST = 0.5
+ERASE_COST = 45000
+
+BASE = 0x310000
+
+
+def sim_flash():
+    dcz = dczhost.load()
+
+    class HostSimFlash(dcz.SimFlash):
+        def encrypt(self,chksum,buf):
+            key = chksum.to_bytes(4,"little")
+            for i in range(len(buf)):
+                buf[i]^=key[i&3]
+
+        decrypt = encrypt
+
+    return HostSimFlash(SECTOR,READ_COST,WRITE_COST,ERASE_COST)
+
+def slot(size):
+    # round up to whole sectors, so that DCZs and resources never share a sector
+    return ((size+SECTOR-1)//SECTOR)*SECTOR
+
+def quiet(*args):
+    # discard the output of dump, keeping only the JSON records
+    pass
+
+def report(fl,op,entries,replicas,size,t0,out):
+    res = fl.stats()
+    res["ms"] = (time.monotonic()-t0)*1000
+    res["op"] = op
+    res["entries"] = entries
+    res["replicas"] = replicas
+    res["size"] = size
+    out.write(json.dumps(res)+"\n")
+    fl.reset()
+
+def bench(entries,replicas,size,out=sys.stdout):
+    """
+Measure init, finalize, load_resource, save_resource and dump for a configuration, writing a JSON record per operation to out.
+    """
+    dcz = dczhost.load()
+    fl = sim_flash()
+    # place the DCZs first, then the resource slots
+    mapping = []
+    addr = BASE
+    for i in range(replicas):
+        mapping.append(addr)
+        addr+=slot(dcz.HEADER_SIZE+entries*dcz.ENTRY_SIZE)
+    data = bytearray(i&0xff for i in range(size))
+    resources = []
+    for j in range(entries):
+        addrs = []
+        for i in range(replicas):
+            addrs.append(addr)
+            addr+=slot(size)
+        # the first resource requires encryption, to give finalize some work
+        resources.append(["res"+str(j),addrs,data,"bin",1 if j==0 else 0])
+    dcz.format_dcz(fl,mapping,resources)
+    last = "res"+str(entries-1)
+
+    fl.reset()
+    t0 = time.monotonic()
+    dc = dcz.DCZ(mapping,flash=fl)
+    report(fl,"init",entries,replicas,size,t0,out)
+
+    t0 = time.monotonic()
+    dc.finalize()
+    report(fl,"finalize",entries,replicas,size,t0,out)
+
+    t0 = time.monotonic()
+    buf = dc.load_resource(last,check=True)
+    report(fl,"load_resource",entries,replicas,size,t0,out)
+
+    t0 = time.monotonic()
+    dc.save_resource(last,buf,version=dc.next_version())
+    report(fl,"save_resource",entries,replicas,size,t0,out)
+
+    t0 = time.monotonic()
+    dc.dump(entries=True,printer=quiet)
+    report(fl,"dump",entries,replicas,size,t0,out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the DCZ benchmark on a simulated flash")
+    parser.add_argument("-e","--entries",type=int,nargs="+",default=ENTRIES,help="numbers of resources")
+    parser.add_argument("-r","--replicas",type=int,nargs="+",default=REPLICAS,help="numbers of DCZs")
+    parser.add_argument("-s","--sizes",type=int,nargs="+",default=SIZES,help="resource sizes in bytes")
+    args = parser.parse_args(argv)
+
+    for entries in args.entries:
+        for replicas in args.replicas:
+            for size in args.sizes:
+                bench(entries,replicas,size)
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
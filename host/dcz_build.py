@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Build provisioning images from a dcz.yml file.
+
+The DCZ tables and the resources described by dcz.yml are laid out with the same code running on the devices
+(dcz.build_dcz, executed by dczhost), so the images are byte for byte what format_dcz would write.
+
+    python3 dcz_build.py examples/DCZ_Basic/dcz.yml -o out
+
+writes out/image.bin, a flat image starting at the lowest address, with the bytes not covered by any resource set to 0xff.
+With --sparse, out/image/ gets a file for each written blob instead, named after its address.
+
+Per device images are built by giving a directory with a subdirectory for each device: files in a device subdirectory
+named as a resource replace it (see dczhost.config). Images are built in parallel by a pool of --jobs processes
+and named after the device subdirectories:
+
+    python3 dcz_build.py dcz.yml --devices devices/ -o out -j 8
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import dczhost
+from dczhost.config import Config
+
+SECTOR = 4096
+
+
+def build(config,device=None,version=0):
+    """
+Return the sparse image of config (a Config), as a list of [address, data] pairs,
+with the resources of device (a directory, see Config.data) if given.
+    """
+    dcz = dczhost.load()
+    resources = []
+    for res in config.resources:
+        resources.append([res.name,res.mapping,config.data(res,device),res.format,res.encrypt])
+    blobs = []
+    for res in config.extra:
+        data = config.data(res,device)
+        for addr in res.mapping:
+            blobs.append([addr,data])
+    if config.mapping:
+        blobs.extend(dcz.build_dcz(config.mapping,resources,version))
+    return blobs
+
+def span(blobs,sector=SECTOR):
+    # smallest range of whole sectors covering all the blobs
+    start = min(addr for addr, data in blobs)
+    end = max(addr+len(data) for addr, data in blobs)
+    start -= start%sector
+    end += (sector-end%sector)%sector
+    return start, end-start
+
+def write_image(blobs,out,sparse=False,base=None,size=None):
+    dcz = dczhost.load()
+    if sparse:
+        os.makedirs(out,exist_ok=True)
+        for addr, data in blobs:
+            with open(os.path.join(out,"0x%08x.bin" % addr),"wb") as f:
+                f.write(data)
+        return out
+    if base is None or size is None:
+        sbase, ssize = span(blobs)
+        base = sbase if base is None else base
+        size = ssize if size is None else size
+    out += ".bin"
+    with open(out,"wb") as f:
+        f.write(dcz.build_image(blobs,base,size))
+    return out
+
+def build_device(job):
+    # worker of the process pool: build and write the image of a device
+    config, device, out, sparse, base, size, version = job
+    return write_image(build(config,device,version),out,sparse,base,size)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build DCZ provisioning images from a dcz.yml file")
+    parser.add_argument("config",help="path of dcz.yml")
+    parser.add_argument("-o","--out",default=".",help="output directory")
+    parser.add_argument("-d","--devices",help="directory with a subdirectory of resources for each device")
+    parser.add_argument("-s","--sparse",action="store_true",help="write a file for each blob instead of a flat image")
+    parser.add_argument("--base",type=lambda x: int(x,0),help="start address of flat images (default: lowest address)")
+    parser.add_argument("--size",type=lambda x: int(x,0),help="size of flat images (default: up to the highest address)")
+    parser.add_argument("--version",type=int,default=0,help="version of the DCZs")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count(),help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    config = Config(args.config)
+    os.makedirs(args.out,exist_ok=True)
+    if args.devices is None:
+        print(build_device([config,None,os.path.join(args.out,"image"),args.sparse,args.base,args.size,args.version]))
+        return 0
+    jobs = []
+    for name in sorted(os.listdir(args.devices)):
+        device = os.path.join(args.devices,name)
+        if os.path.isdir(device):
+            jobs.append([config,device,os.path.join(args.out,name),args.sparse,args.base,args.size,args.version])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for out in pool.map(build_device,jobs,chunksize=max(1,len(jobs)//(4*(args.jobs or 1)))):
+            print(out)
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
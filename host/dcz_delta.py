@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Build delta packages between two DCZ states, to be applied on the devices with DCZ.apply_delta.
+
+    python3 dcz_delta.py old.bin new.bin --config dcz.yml --base 0x310000 -o delta.bin
+
+old.bin and new.bin are flash images or dumps (for example built by dcz_build.py): the resources of their latest
+valid DCZ are compared as DCZ.load_resource sees them, without deserialization.
+"""
+import argparse
+import os
+import struct
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import dczhost
+from dczhost import natives
+from dczhost.config import Config
+from dczhost.flash import MmapFlash
+
+
+def make_delta(old,new,formats={},gap=8):
+    """
+Build a delta package to update the resources in old to the ones in new, as a bytearray.
+old and new are dicts mapping resource names to their binary representation in the clear, as returned by
+DCZ.load_resource with deserialize set to False. formats maps resource names to their format (default is "bin").
+
+Only the resources of new whose data differ from old are put in the package: as a whole if they are not in old, otherwise
+as the changed byte ranges, if smaller. Changes closer than gap bytes are merged in the same range.
+Every resource carries its target checksum, and the checksum of the resource it must be applied to when made of byte ranges.
+
+The package starts with "DCZD" and the number of resources (16 bits), followed by a record for each resource with
+the name (16 bytes), the format (4 bytes), the kind (0 for whole resources, 1 for byte ranges), the size (32 bits),
+the target checksum (32 bits), the base checksum (32 bits) and:
+
+    * for whole resources, the data
+    * for byte ranges, the number of ranges (16 bits) followed by the offset (32 bits), length (16 bits) and data of each range
+
+All numbers are little endian.
+    """
+    dcz = dczhost.load()
+    out = bytearray(dcz.DELTA_MAGIC)+bytearray(dcz.DELTA_HEADER_SIZE-len(dcz.DELTA_MAGIC))
+    n = 0
+    for name in new:
+        data = bytes(new[name])
+        fmt = formats.get(name,"bin")
+        bname = natives.to_bytes(name)
+        bfmt = natives.to_bytes(fmt)
+        if len(bname)>16:
+            raise ValueError("resource name %r is longer than 16 bytes" % name)
+        if len(bfmt)>4:
+            raise ValueError("format %r of resource %r is longer than 4 bytes" % (fmt,name))
+        base = bytes(old[name]) if name in old else None
+        if base==data:
+            continue
+        ranges = _delta_ranges(base,data,gap) if base is not None else None
+        if ranges is not None and 2+sum(6+end-start for start, end in ranges)>=len(data):
+            ranges = None
+        rec = struct.pack("<16s4sBIII",bname,bfmt,0 if ranges is None else 1,len(data),natives.fletcher32(data),
+                          0 if ranges is None else natives.fletcher32(base))
+        out+=rec
+        if ranges is None:
+            out+=data
+        else:
+            out+=struct.pack("<H",len(ranges))
+            for start, end in ranges:
+                out+=struct.pack("<IH",start,end-start)
+                out+=data[start:end]
+        n+=1
+        if n>0xffff:
+            raise ValueError("too many resources")
+    struct.pack_into("<H",out,4,n)
+    return out
+
+def _delta_ranges(old,new,gap):
+    # list of [start, end] of the bytes of new differing from old, merging ranges closer than gap
+    ranges = []
+    m = len(old)
+    i = 0
+    while i<len(new):
+        if i<m and old[i]==new[i]:
+            i+=1
+            continue
+        start = i
+        end = i+1
+        same = 0
+        i+=1
+        while i<len(new) and i-start<0xffff:
+            if i<m and old[i]==new[i]:
+                same+=1
+                if same>=gap:
+                    break
+            else:
+                same = 0
+                end = i+1
+            i+=1
+        ranges.append([start,end])
+        i = end
+    return ranges
+
+def read_state(path,mapping,base):
+    """
+Return the resources of the latest valid DCZ of the image at path, as two dicts mapping resource names to
+their binary representation in the clear and to their format. Encrypted resources can't be read on the host.
+    """
+    dcz = dczhost.load()
+    with MmapFlash(path,base=base,readonly=True) as flash:
+        dc = dcz.DCZ(mapping,flash=flash)
+        # latest_version does not consider the validity of the tables
+        zone = None
+        for i, valid in enumerate(dc.validate_all()):
+            if valid and (zone is None or dc.dcz_version[i]>dc.dcz_version[zone]):
+                zone = i
+        if zone is None:
+            raise ValueError("%s has no valid DCZ" % path)
+        resources = {}
+        formats = {}
+        for entry in dc.get_table(zone):
+            if entry[5] and entry[6]:
+                raise ValueError("resource %r of %s is encrypted" % (entry[0],path))
+            resources[entry[0]] = bytes(dc.load_data(entry,True,False,False))
+            formats[entry[0]] = entry[3]
+        dc = None
+    return resources, formats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a delta package between the DCZs of two flash images")
+    parser.add_argument("old",help="image with the resources on the devices")
+    parser.add_argument("new",help="image with the updated resources")
+    parser.add_argument("-o","--out",required=True,help="delta package to write")
+    parser.add_argument("-c","--config",help="dcz.yml with the DCZ mapping")
+    parser.add_argument("-m","--mapping",help="comma separated DCZ addresses, instead of --config")
+    parser.add_argument("-b","--base",type=lambda x: int(x,0),default=0,help="address of the first byte of the images")
+    parser.add_argument("-g","--gap",type=int,default=8,help="merge changes closer than gap bytes")
+    args = parser.parse_args(argv)
+
+    if args.mapping:
+        mapping = [int(x,0) for x in args.mapping.split(",")]
+    elif args.config:
+        mapping = Config(args.config).mapping
+    else:
+        parser.error("one of --config and --mapping is required")
+    old, oformats = read_state(args.old,mapping,args.base)
+    new, formats = read_state(args.new,mapping,args.base)
+    delta = make_delta(old,new,formats,args.gap)
+    with open(args.out,"wb") as f:
+        f.write(delta)
+    print("%s: %d bytes" % (args.out,len(delta)))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
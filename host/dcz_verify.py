@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Verify the DCZs in raw flash dumps.
+
+    python3 dcz_verify.py --config dcz.yml --base 0x310000 dumps/*.bin
+
+For each dump, a JSON line is printed with the report of DCZ.verify: the "latest" valid version and, for each DCZ,
+its "version", the "valid" flag of its table and the "corrupted", "unfinalized" and "encrypted" resource names.
+Encrypted resources can only be decrypted by the device that encrypted them, therefore they are listed as "encrypted"
+and not checked; unfinalized resources are still in the clear and are checked.
+
+Dumps are parsed with the natives of dczhost, and the checksums of the resources of many dumps are computed in
+batches: with NumPy, a batch is checksummed in a few vectorized operations, bit exact with csrc/dcz.c.
+Without NumPy, the pure Python fletcher32 of dczhost is used.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from dczhost import natives
+from dczhost.config import Config
+from dczhost.flash import MmapFlash
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# words checksummed by each vectorized batch
+BATCH_WORDS = 1<<22
+
+
+def fletcher32_batch(bufs):
+    """
+Return the list of the fletcher32 checksums of bufs, as computed by csrc/dcz.c.
+    """
+    if np is None:
+        return [natives.fletcher32(b) for b in bufs]
+    res = []
+    i = 0
+    while i<len(bufs):
+        # at least one buffer per batch, even if bigger than BATCH_WORDS
+        j = i+1
+        words = (len(bufs[i])+1)//2
+        while j<len(bufs) and words+(len(bufs[j])+1)//2<=BATCH_WORDS:
+            words+=(len(bufs[j])+1)//2
+            j+=1
+        res.extend(_np_fletcher32(bufs[i:j]))
+        i = j
+    return res
+
+def _np_fletcher32(bufs):
+    # word i of n is added once to sum1 and n-i times to sum2: with i the index in the whole batch and g0 the index
+    # of the first word of a buffer, sum2 = n*sum(w)-sum((i-g0)*w), everything modulo 0xffff
+    p = 0xffff
+    data = bytearray()
+    nw = []
+    for b in bufs:
+        data+=b
+        if len(b)&1:
+            data.append(0)
+        nw.append((len(b)+1)//2)
+    nw = np.array(nw,dtype=np.int64)
+    starts = np.concatenate(([0],np.cumsum(nw)[:-1])).astype(np.int64)
+    w = np.frombuffer(bytes(data),dtype="<u2").astype(np.int64)
+    g = np.arange(len(w),dtype=np.int64)%p
+    s1 = np.zeros(len(bufs),dtype=np.int64)
+    gs = np.zeros(len(bufs),dtype=np.int64)
+    full = nw>0
+    if len(w):
+        s1[full] = np.add.reduceat(w,starts[full])
+        gs[full] = np.add.reduceat(g*w%p,starts[full])
+    s1%=p
+    local = (gs-(starts%p)*s1)%p
+    s2 = ((nw%p)*s1-local)%p
+    return [int(x) for x in (s2<<16)|s1]
+
+def scan(flash,mapping):
+    """
+Parse the DCZs of a dump and return the report without the resource checks, together with the list of
+[zone, entry, data] of the resources to checksum, with data a view of the dump.
+    """
+    report = {"latest":-1,"zones":[]}
+    checks = []
+    for i, addr in enumerate(mapping):
+        try:
+            header = natives._dcz_decode_header(flash.view(addr,natives.HEADER_SIZE))
+            buf = flash.view(addr,natives.HEADER_SIZE+header[2]*natives.ENTRY_SIZE)
+        except ValueError:
+            # out of the dump, surely not a table
+            report["zones"].append({"version":None,"valid":False,"corrupted":[],"unfinalized":[],"encrypted":[]})
+            continue
+        header, chksum, table = natives._dcz_decode_table(buf,i)
+        zone = {"version":header[1],"valid":header[3]==chksum,"corrupted":[],"unfinalized":[],"encrypted":[]}
+        report["zones"].append(zone)
+        if not zone["valid"]:
+            continue
+        report["latest"] = max(report["latest"],header[1])
+        for entry in table:
+            if entry[5] and entry[6]:
+                zone["encrypted"].append(entry[0])
+                continue
+            if entry[5]:
+                zone["unfinalized"].append(entry[0])
+            try:
+                data = flash.view(entry[1][i],entry[2])
+            except ValueError:
+                zone["corrupted"].append(entry[0])
+                continue
+            checks.append([zone,entry,data])
+    return report, checks
+
+def verify(paths,mapping,base):
+    """
+Verify the dumps at paths, with the DCZs at the addresses in mapping and the dumps starting at base.
+Return the list of the reports, in the order of paths.
+    """
+    flashes = []
+    reports = []
+    checks = []
+    try:
+        for path in paths:
+            flash = MmapFlash(path,base=base,readonly=True)
+            flashes.append(flash)
+            report, chk = scan(flash,mapping)
+            reports.append(report)
+            checks.extend(chk)
+        sums = fletcher32_batch([data for zone, entry, data in checks])
+        for k in range(len(checks)):
+            if sums[k]!=checks[k][1][4]:
+                checks[k][0]["corrupted"].append(checks[k][1][0])
+    finally:
+        # the maps can't be closed while views of them are alive
+        for zone, entry, data in checks:
+            data.release()
+        for flash in flashes:
+            flash.close()
+    return reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the DCZs in raw flash dumps")
+    parser.add_argument("dumps",nargs="+",help="flash dumps")
+    parser.add_argument("-c","--config",help="dcz.yml with the DCZ mapping")
+    parser.add_argument("-m","--mapping",help="comma separated DCZ addresses, instead of --config")
+    parser.add_argument("-b","--base",type=lambda x: int(x,0),default=0,help="address of the first byte of the dumps")
+    parser.add_argument("-n","--batch",type=int,default=256,help="number of dumps verified together")
+    args = parser.parse_args(argv)
+
+    if args.mapping:
+        mapping = [int(x,0) for x in args.mapping.split(",")]
+    elif args.config:
+        mapping = Config(args.config).mapping
+    else:
+        parser.error("one of --config and --mapping is required")
+    bad = 0
+    for i in range(0,len(args.dumps),args.batch):
+        paths = args.dumps[i:i+args.batch]
+        for path, report in zip(paths,verify(paths,mapping,args.base)):
+            report["dump"] = path
+            print(json.dumps(report))
+            if report["latest"]<0 or any(z["valid"] and z["corrupted"] for z in report["zones"]):
+                bad+=1
+    return 1 if bad else 0
+
+if __name__=="__main__":
+    sys.exit(main())
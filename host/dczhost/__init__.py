@@ -0,0 +1,77 @@
+"""
+Run the DCZ library on the host, with CPython.
+
+load() executes dcz.py with the natives in csrc replaced by their pure Python equivalents in dczhost.natives, so that the
+very same code running on the devices can build, inspect and update DCZ images on a PC. Use it together with
+dczhost.flash.MmapFlash, or with the RamFlash and SimFlash backends of dcz.py:
+
+    import dczhost
+    from dczhost.flash import MmapFlash
+
+    dcz = dczhost.load()
+    flash = MmapFlash("dump.bin",base=0x310000)
+    dc = dcz.DCZ([0x310000,0x311000],flash=flash)
+"""
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+from . import natives
+
+__all__ = ["load","natives"]
+
+DCZ_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),"dcz.py")
+
+PRIO_LOWEST = 0
+
+_module = None
+
+
+def native_c(name,*sources):
+    fn = getattr(natives,name)
+    def wrap(stub):
+        return fn
+    return wrap
+
+def thread(fn,*args,prio=None):
+    t = threading.Thread(target=fn,args=args,daemon=True)
+    t.start()
+    return t
+
+def sleep(ms):
+    time.sleep(ms/1000)
+
+def _timers():
+    timers = types.ModuleType("timers")
+    timers.now = lambda: int(time.monotonic()*1000)
+    return timers
+
+def load(path=None):
+    """
+Execute dcz.py (the one of this repository if path is None) and return it as a module named "dcz".
+The module is loaded once: later calls return the same module.
+    """
+    global _module
+    if _module is not None and path is None:
+        return _module
+    if "timers" not in sys.modules:
+        sys.modules["timers"] = _timers()
+    with open(path or DCZ_PY) as f:
+        src = f.read()
+    src = re.sub(r"new_exception\((\w+),(\w+)\)",r"class \1(\2): pass",src)
+    mod = types.ModuleType("dcz")
+    mod.__file__ = path or DCZ_PY
+    mod.native_c = native_c
+    mod.thread = thread
+    mod.sleep = sleep
+    mod.PRIO_LOWEST = PRIO_LOWEST
+    exec(compile(src,mod.__file__,"exec"),mod.__dict__)
+    # Zerynth strings are bytes: convert at the boundary
+    mod._get_str = natives.get_str
+    mod._put_str = natives.put_str
+    if path is None:
+        _module = mod
+    return mod
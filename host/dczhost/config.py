@@ -0,0 +1,68 @@
+"""
+Read the provisioning and dcz sections of a dcz.yml file.
+"""
+import os
+
+import yaml
+
+
+class Resource():
+    def __init__(self,name,type,args,mapping,format="bin",encrypt=False):
+        if len(name.encode("latin-1"))>16:
+            raise ValueError("resource name %r is longer than 16 bytes" % name)
+        if len(format.encode("latin-1"))>4:
+            raise ValueError("format %r of resource %r is longer than 4 bytes" % (format,name))
+        self.name = name
+        self.type = type
+        self.args = args
+        self.mapping = list(mapping)
+        self.format = format
+        self.encrypt = 1 if encrypt else 0
+
+
+class Config():
+    """
+The content of a dcz.yml file: the DCZ mapping, the resources in the DCZ (in table order) and the
+other provisioned resources, that are written at their addresses but not listed in the DCZ.
+    """
+    def __init__(self,path):
+        self.path = os.path.abspath(path)
+        self.root = os.path.dirname(self.path)
+        with open(self.path) as f:
+            cfg = yaml.safe_load(f) or {}
+        if not cfg.get("active"):
+            raise ValueError("%s is not active" % path)
+        resources = {}
+        for r in (cfg.get("provisioning") or {}).get("resources") or []:
+            res = Resource(r["name"],r.get("type","file"),r.get("args"),r["mapping"],r.get("format","bin"),r.get("encrypt",False))
+            resources[res.name] = res
+        dcz = cfg.get("dcz") or {}
+        self.mapping = list(dcz.get("mapping") or [])
+        if len(self.mapping)>8:
+            raise ValueError("at most 8 DCZs can be mapped")
+        self.resources = []
+        for name in dcz.get("resources") or []:
+            if name not in resources:
+                raise ValueError("DCZ resource %r is not provisioned" % name)
+            res = resources.pop(name)
+            if len(res.mapping)!=len(self.mapping):
+                raise ValueError("resource %r must have exactly %d addresses" % (name,len(self.mapping)))
+            self.resources.append(res)
+        self.extra = list(resources.values())
+
+    def data(self,res,device=None):
+        """
+Return the binary content of res. If device is a directory holding a file named as the resource, that file is used:
+this is how per device resources (keys, certificates, ids...) are given. Otherwise resources of type "file" are read
+from their args, relative to the dcz.yml directory.
+        """
+        if device is not None:
+            path = os.path.join(device,res.name)
+            if os.path.isfile(path):
+                with open(path,"rb") as f:
+                    return bytearray(f.read())
+        if res.type!="file":
+            raise ValueError("resource %r of type %r must be given for each device" % (res.name,res.type))
+        args = res.args[0] if isinstance(res.args,list) else res.args
+        with open(os.path.join(self.root,args),"rb") as f:
+            return bytearray(f.read())
@@ -0,0 +1,100 @@
+"""
+Storage backends for the host.
+"""
+import mmap
+import os
+
+
+class MmapFlash():
+    """
+A storage backend for CPython, with the same interface as dcz.Flash, keeping the flash content in a memory map.
+
+If path is given, the file is mapped (it must be at least size bytes long, the whole file is mapped if size is None),
+otherwise an anonymous map of size bytes is created, initialized as erased flash (all bytes at 0xff).
+The map covers the addresses from base to base+size.
+
+Like the device flash, every sector touched by write is erased first, while program writes without erasing and can only
+turn bits from 1 to 0. Encryption uses the encrypt(chksum,buf) and decrypt(chksum,buf) functions given, if any: the keys of
+the devices are not available on the host.
+    """
+    programmable = True
+
+    def __init__(self,path=None,base=0,size=None,sector=4096,encrypt=None,decrypt=None,readonly=False):
+        self.base = base
+        self.sector = sector
+        self.encrypt_fn = encrypt
+        self.decrypt_fn = decrypt
+        self.file = None
+        if path is None:
+            if size is None:
+                raise ValueError("size is required for anonymous maps")
+            self.mem = mmap.mmap(-1,size)
+            self.mem.write(b"\xff"*size)
+        else:
+            self.file = open(path,"rb" if readonly else "r+b")
+            if size is None:
+                size = os.fstat(self.file.fileno()).st_size
+            self.mem = mmap.mmap(self.file.fileno(),size,access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        self.size = size
+
+    def close(self):
+        self.mem.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def _pos(self,addr,size):
+        pos = addr-self.base
+        if pos<0 or pos+size>self.size:
+            raise ValueError
+        return pos
+
+    def view(self,addr,size):
+        """
+Return a read only memoryview of size bytes at addr, without copying.
+        """
+        pos = self._pos(addr,size)
+        return memoryview(self.mem)[pos:pos+size].toreadonly()
+
+    def read(self,addr,size,buf):
+        pos = self._pos(addr,size)
+        buf[0:size] = self.mem[pos:pos+size]
+        return buf
+
+    def write(self,addr,data):
+        pos = self._pos(addr,len(data))
+        if not len(data):
+            return
+        # sectors are aligned on the flash addresses, base may not be
+        end = addr+len(data)
+        first = max(addr-addr%self.sector-self.base,0)
+        last = min(end+(self.sector-end%self.sector)%self.sector-self.base,self.size)
+        self.mem[first:last] = b"\xff"*(last-first)
+        self.mem[pos:pos+len(data)] = bytes(data)
+
+    def program(self,addr,data):
+        pos = self._pos(addr,len(data))
+        n = len(data)
+        if not n:
+            return
+        old = int.from_bytes(self.mem[pos:pos+n],"little")
+        self.mem[pos:pos+n] = (old&int.from_bytes(bytes(data),"little")).to_bytes(n,"little")
+
+    def flush(self):
+        self.mem.flush()
+
+    def encrypt(self,chksum,buf):
+        if self.encrypt_fn is None:
+            raise NotImplementedError("device keys are not available on the host")
+        self.encrypt_fn(chksum,buf)
+
+    def decrypt(self,chksum,buf):
+        if self.decrypt_fn is None:
+            raise NotImplementedError("device keys are not available on the host")
+        self.decrypt_fn(chksum,buf)
@@ -0,0 +1,416 @@
+"""
+Host equivalents of the natives in csrc/dcz.c and csrc/lz.c.
+
+Each function has the name of the C native and the signature of the Python stub
+declared in dcz.py, and returns the same values. Strings given to the natives can be
+str or bytes, strings returned by the natives are str.
+"""
+import operator
+import struct
+
+HEADER_SIZE = 16
+ENTRY_SIZE = 64
+
+# DCZHeader and DCZEntry, little endian and packed as in csrc/dcz.c
+HEADER = struct.Struct("<IIIHH")
+ENTRY = struct.Struct("<16s8II4sIBxH")
+
+KV_INT = 0
+KV_STR = 1
+KV_MIN = -(1<<31)
+KV_MAX = (1<<31)-1
+
+LZ_WINDOW = 1024
+LZ_MIN_MATCH = 3
+LZ_MAX_MATCH = 34
+LZ_MAX_LITERALS = 128
+LZ_HASH_BITS = 10
+LZ_STATE = struct.Struct("<IHHHBB")
+
+FLETCHER_STATE = struct.Struct("<HHBBH")
+
+
+def to_bytes(s):
+    if isinstance(s,str):
+        return s.encode("latin-1")
+    return bytes(s)
+
+def to_str(b):
+    return bytes(b).decode("latin-1")
+
+def get_str(buf,pos,size):
+    # host version of dcz._get_str
+    b = bytes(buf[pos:pos+size])
+    n = b.find(b"\0")
+    if n>=0:
+        b = b[:n]
+    return to_str(b)
+
+def put_str(buf,pos,s):
+    # host version of dcz._put_str
+    b = to_bytes(s)
+    buf[pos:pos+len(b)]=b
+
+
+##### fletcher32
+
+def fletcher_sums(buf):
+    # sums of the 16 bits little endian words of buf, a trailing odd byte counts as a word
+    buf = memoryview(to_bytes(buf) if isinstance(buf,str) else buf).cast("B")
+    n = len(buf)
+    if n&1:
+        words = list(memoryview(bytes(buf[:n-1])).cast("H")) if n>1 else []
+        words.append(buf[n-1])
+    else:
+        words = memoryview(bytes(buf)).cast("H") if n else []
+    nw = len(words)
+    s1 = sum(words)
+    # word i of nw is added nw-i times to sum2
+    s2 = nw*s1-sum(map(operator.mul,range(nw),words))
+    return s1%0xffff, s2%0xffff
+
+def fletcher32(buf):
+    s1, s2 = fletcher_sums(buf)
+    return (s2<<16)|s1
+
+def _dcz_fletcher32(buf):
+    return fletcher32(buf)
+
+def _dcz_fletcher32_update(state,buf,size):
+    sum1, sum2, odd, last, unused = FLETCHER_STATE.unpack_from(state)
+    buf = to_bytes(buf[:size]) if size<len(buf) else to_bytes(buf)
+    if odd and buf:
+        sum1 = (sum1+(last|(buf[0]<<8)))%0xffff
+        sum2 = (sum1+sum2)%0xffff
+        odd = 0
+        buf = buf[1:]
+    n = len(buf)&~1
+    if n:
+        w1, w2 = fletcher_sums(buf[:n])
+        # the words of buf are added after sum1 has already been accumulated
+        sum2 = (sum2+(n//2)*sum1+w2)%0xffff
+        sum1 = (sum1+w1)%0xffff
+    if len(buf)&1:
+        odd = 1
+        last = buf[-1]
+    FLETCHER_STATE.pack_into(state,0,sum1,sum2,odd,last,unused)
+    return state
+
+def _dcz_fletcher32_digest(state):
+    sum1, sum2, odd, last, unused = FLETCHER_STATE.unpack_from(state)
+    if odd:
+        sum1 = (sum1+last)%0xffff
+        sum2 = (sum1+sum2)%0xffff
+    return (sum2<<16)|sum1
+
+def _dcz_fletcher32_patch(chk,size,start,old,new):
+    if (start&1) or len(old)!=len(new) or start>size or len(old)>size-start:
+        raise ValueError
+    if (len(old)&1) and start+len(old)!=size:
+        raise ValueError
+    sum1 = chk&0xffff
+    sum2 = (chk>>16)&0xffff
+    n = (size+1)//2
+    for i in range(0,len(old),2):
+        if i+1<len(old):
+            w = old[i]|(old[i+1]<<8)
+            d = new[i]|(new[i+1]<<8)
+        else:
+            w = old[i]
+            d = new[i]
+        if w==d:
+            continue
+        d = (d+0xffff-w)%0xffff
+        sum1 = (sum1+d)%0xffff
+        sum2 = (sum2+((n-(start+i)//2)%0xffff)*d)%0xffff
+    return (sum2<<16)|sum1
+
+
+##### tables
+
+def _header_list(buf):
+    chksum, size, version, entries, cardinality = HEADER.unpack_from(buf)
+    return [size,version,entries,chksum,cardinality]
+
+def _entry_list(buf,pos=0):
+    f = ENTRY.unpack_from(buf,pos)
+    return [get_str(f[0],0,16),list(f[1:9]),f[9],get_str(f[10],0,4),f[11],f[12],f[13]]
+
+def _dcz_decode_header(buf):
+    return _header_list(buf)
+
+def _dcz_decode_entry(buf):
+    return _entry_list(buf)
+
+def _dcz_decode_table(buf,version):
+    if len(buf)<HEADER_SIZE:
+        raise ValueError
+    header = _header_list(buf)
+    entries = header[2]
+    if HEADER_SIZE+entries*ENTRY_SIZE>len(buf):
+        raise ValueError
+    table = []
+    for i in range(entries):
+        entry = _entry_list(buf,HEADER_SIZE+i*ENTRY_SIZE)
+        entry.append(i)
+        entry.append(version)
+        table.append(entry)
+    return [header,fletcher32(memoryview(buf)[4:]),table]
+
+def _dcz_find_entry(buf,name):
+    if len(buf)<HEADER_SIZE:
+        raise ValueError
+    entries = _header_list(buf)[2]
+    if HEADER_SIZE+entries*ENTRY_SIZE>len(buf):
+        entries = (len(buf)-HEADER_SIZE)//ENTRY_SIZE
+    name = to_bytes(name)
+    if len(name)>16:
+        return -1
+    tag = name+b"\0"*(16-len(name))
+    for i in range(entries):
+        pos = HEADER_SIZE+i*ENTRY_SIZE
+        if bytes(buf[pos:pos+len(name)])==name and (len(name)==16 or buf[pos+len(name)]==0):
+            return i
+    return -1
+
+def _dcz_encode_header(hbuf,size,version,entries):
+    chksum, osize, oversion, oentries, cardinality = HEADER.unpack_from(hbuf)
+    HEADER.pack_into(hbuf,0,0,size,version,entries,cardinality)
+    HEADER.pack_into(hbuf,0,fletcher32(memoryview(hbuf)[4:]),size,version,entries,cardinality)
+    return hbuf
+
+def _dcz_encode_entry(hbuf,index,entry):
+    pos = HEADER_SIZE+index*ENTRY_SIZE
+    f = list(ENTRY.unpack_from(hbuf,pos))
+    name = to_bytes(entry[0])
+    fmt = to_bytes(entry[3])
+    if len(name)>16 or len(fmt)>4:
+        raise ValueError
+    f[0] = name
+    for i in range(8):
+        f[1+i] = entry[1][i]&0xffffffff
+    f[9] = entry[2]
+    f[10] = fmt
+    f[11] = entry[4]&0xffffffff
+    f[13] = 1 if f[12] and entry[6] else 0
+    ENTRY.pack_into(hbuf,pos,*f)
+    return hbuf
+
+
+##### kv
+
+def _kv_skip(buf,pos):
+    # position of the item after the one at pos, 0 if malformed
+    n = len(buf)
+    if pos+1>n:
+        return 0
+    pos += 1+buf[pos]
+    if pos+1>n:
+        return 0
+    if buf[pos]==KV_INT:
+        pos += 5
+    elif buf[pos]==KV_STR:
+        if pos+3>n:
+            return 0
+        pos += 3+(buf[pos+1]|(buf[pos+2]<<8))
+    else:
+        return 0
+    if pos>n:
+        return 0
+    return pos
+
+def _kv_value(buf,pos):
+    pos += 1+buf[pos]
+    if buf[pos]==KV_INT:
+        return struct.unpack_from("<i",buf,pos+1)[0]
+    n = buf[pos+1]|(buf[pos+2]<<8)
+    return to_str(buf[pos+3:pos+3+n])
+
+def _kv_item(key,value):
+    key = to_bytes(key)
+    if len(key)>0xff:
+        raise ValueError
+    if isinstance(value,bool) or not isinstance(value,(int,str,bytes,bytearray)):
+        raise TypeError
+    if isinstance(value,int):
+        # values are stored in 32 bits
+        if value<KV_MIN or value>KV_MAX:
+            raise ValueError
+        return bytes([len(key)])+key+bytes([KV_INT])+struct.pack("<i",value)
+    value = to_bytes(value)
+    if len(value)>0xffff:
+        raise ValueError
+    return bytes([len(key)])+key+bytes([KV_STR])+struct.pack("<H",len(value))+value
+
+def _dcz_kv_encode(items):
+    if not isinstance(items,list) or len(items)&1:
+        raise TypeError
+    if len(items)//2>0xffff:
+        raise ValueError
+    for i in range(0,len(items),2):
+        if not isinstance(items[i],(str,bytes,bytearray)):
+            raise TypeError
+    return bytearray(struct.pack("<H",len(items)//2)+b"".join(_kv_item(items[i],items[i+1]) for i in range(0,len(items),2)))
+
+def _dcz_kv_decode(buf):
+    if len(buf)<2:
+        raise ValueError
+    n = buf[0]|(buf[1]<<8)
+    pos = 2
+    for i in range(n):
+        pos = _kv_skip(buf,pos)
+        if not pos:
+            raise ValueError
+    obj = {}
+    pos = 2
+    for i in range(n):
+        obj[to_str(buf[pos+1:pos+1+buf[pos]])] = _kv_value(buf,pos)
+        pos = _kv_skip(buf,pos)
+    return obj
+
+def _dcz_kv_scan(buf,start,end,key,count):
+    if start<0 or start>end or end>len(buf):
+        raise ValueError
+    key = to_bytes(key)
+    window = memoryview(buf)[:end]
+    pos = start
+    i = 0
+    value = None
+    while i<count:
+        nxt = _kv_skip(window,pos)
+        if not nxt:
+            break
+        i+=1
+        if buf[pos]==len(key) and bytes(buf[pos+1:pos+1+len(key)])==key:
+            value = _kv_value(buf,pos)
+            pos = nxt
+            break
+        pos = nxt
+    return [pos,i,value]
+
+
+##### lz
+
+def _lz_hash(src,i):
+    return (((src[i]<<16)|(src[i+1]<<8)|src[i+2])*2654435761&0xffffffff)>>(32-LZ_HASH_BITS)
+
+def _lz_literals(src,frm,to,dst,op):
+    while frm<to:
+        n = min(to-frm,LZ_MAX_LITERALS)
+        if op+1+n>len(dst):
+            return -1
+        dst[op] = n-1
+        dst[op+1:op+1+n] = src[frm:frm+n]
+        op += 1+n
+        frm += n
+    return op
+
+def _lz_compress(src,dst,start,work):
+    # same output of the native: a host compressed resource is identical to a device compressed one
+    src = to_bytes(src)
+    if len(work)<(4<<LZ_HASH_BITS) or start<0 or start>len(dst):
+        raise ValueError
+    head = [0]*(1<<LZ_HASH_BITS)
+    n = len(src)
+    op = start
+    ip = 0
+    anchor = 0
+    while ip+LZ_MIN_MATCH<=n:
+        h = _lz_hash(src,ip)
+        cand = head[h]
+        head[h] = ip+1
+        if not cand or ip-(cand-1)>LZ_WINDOW:
+            ip += 1
+            continue
+        cand -= 1
+        mlen = 0
+        while mlen<LZ_MAX_MATCH and ip+mlen<n and src[cand+mlen]==src[ip+mlen]:
+            mlen += 1
+        if mlen<LZ_MIN_MATCH:
+            ip += 1
+            continue
+        op = _lz_literals(src,anchor,ip,dst,op)
+        if op<0 or op+2>len(dst):
+            return -1
+        off = ip-cand-1
+        dst[op] = 0x80|((mlen-LZ_MIN_MATCH)<<2)|(off>>8)
+        dst[op+1] = off&0xff
+        op += 2
+        k = ip+1
+        while k<ip+mlen and k+LZ_MIN_MATCH<=n:
+            head[_lz_hash(src,k)] = k+1
+            k += 1
+        ip += mlen
+        anchor = ip
+    return _lz_literals(src,anchor,n,dst,op)
+
+def _lz_decompress(src,start,dst):
+    if start<0 or start>len(src):
+        raise ValueError
+    ip = start
+    op = 0
+    while ip<len(src):
+        c = src[ip]
+        ip += 1
+        if not c&0x80:
+            n = c+1
+            if ip+n>len(src) or op+n>len(dst):
+                raise ValueError
+            dst[op:op+n] = src[ip:ip+n]
+            ip += n
+            op += n
+        else:
+            if ip>=len(src):
+                raise ValueError
+            off = (((c&3)<<8)|src[ip])+1
+            ip += 1
+            n = ((c>>2)&0x1f)+LZ_MIN_MATCH
+            if off>op or op+n>len(dst):
+                raise ValueError
+            for i in range(n):
+                dst[op] = dst[op-off]
+                op += 1
+    return op
+
+def _lz_decode(state,src,start,end,dst,pos):
+    if len(state)<LZ_STATE.size+LZ_WINDOW:
+        raise ValueError
+    if start<0 or end<start or end>len(src) or pos<0 or pos>len(dst):
+        raise ValueError
+    total, lit, mlen, moff, ctl, has_ctl = LZ_STATE.unpack_from(state)
+    wpos = LZ_STATE.size
+    ip = start
+    op = pos
+    while op<len(dst):
+        if lit:
+            if ip>=end:
+                break
+            b = src[ip]
+            ip += 1
+            lit -= 1
+        elif mlen:
+            b = state[wpos+((total-moff)&(LZ_WINDOW-1))]
+            mlen -= 1
+        else:
+            if ip>=end:
+                break
+            b = src[ip]
+            ip += 1
+            if has_ctl:
+                moff = (((ctl&3)<<8)|b)+1
+                mlen = ((ctl>>2)&0x1f)+LZ_MIN_MATCH
+                has_ctl = 0
+                if moff>total:
+                    raise ValueError
+            elif b&0x80:
+                ctl = b
+                has_ctl = 1
+            else:
+                lit = b+1
+            continue
+        dst[op] = b
+        state[wpos+(total&(LZ_WINDOW-1))] = b
+        total += 1
+        op += 1
+    LZ_STATE.pack_into(state,0,total&0xffffffff,lit,mlen,moff,ctl,has_ctl)
+    return [ip,op-pos]
@@ -0,0 +1,46 @@
+"""
+Fixtures running dcz.py on the host through dczhost, with the DCZs in a RamFlash.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(ROOT,"host"))
+
+import dczhost
+
+BASE = 0x310000
+SIZE = 0x20000
+MAPPING = [0x310000,0x311000]
+
+
+def resource(name,n,data,format="bin",encrypt=0):
+    # the n-th resource of a layout, with a sector for each copy
+    return [name,[BASE+0x2000+0x2000*n,BASE+0x3000+0x2000*n],bytearray(data),format,encrypt]
+
+
+@pytest.fixture(scope="session")
+def dcz():
+    return dczhost.load()
+
+@pytest.fixture
+def make(dcz):
+    """
+Return a function formatting a RamFlash with the given resources and returning the flash and a DCZ on it.
+    """
+    def make(resources,**kwargs):
+        flash = dcz.RamFlash(BASE,SIZE)
+        dcz.format_dcz(flash,MAPPING,resources)
+        return flash, dcz.DCZ(MAPPING,flash=flash,**kwargs)
+    return make
+
+@pytest.fixture
+def corrupt():
+    """
+Return a function flipping the byte at addr of a RamFlash.
+    """
+    def corrupt(flash,addr):
+        flash.mem[addr-flash.base]^=0xff
+    return corrupt
@@ -0,0 +1,46 @@
+//minimal stand-in for the Zerynth VM header, enough to build csrc/dcz.c as a host shared library for the tests:
+//the natives compile but only the plain C helpers (like _fletcher32) are meant to be called
+#ifndef ZERYNTH_STUB_H
+#define ZERYNTH_STUB_H
+#include <stdint.h>
+#include <string.h>
+
+typedef struct _pobject {int type; int len; uint8_t *bytes; int64_t value; struct _pobject **items;} PObject;
+typedef PObject PList;
+typedef PObject PString;
+typedef PObject PBytes;
+typedef PObject PDict;
+
+#define ERR_OK 0
+#define ERR_TYPE_EXC 1
+#define ERR_VALUE_EXC 2
+#define ERR_INDEX_EXC 3
+
+#define PSMALLINT 1
+#define PINTEGER 2
+#define PSTRING 3
+#define PBYTES 4
+#define PBYTEARRAY 5
+#define PLIST 6
+#define PNONE 7
+
+#define C_NATIVE(fn) int fn(int nargs, PObject *self, PObject **args, PObject **res)
+#define NATIVE_UNWARN() (void)self
+#define MAKE_NONE() ((PObject*)0)
+#define PTYPE(o) ((o)->type)
+#define PSEQUENCE_ELEMENTS(o) ((o)->len)
+#define PSEQUENCE_BYTES(o) ((o)->bytes)
+#define PLIST_ITEM(l,i) ((l)->items[i])
+#define PLIST_SET_ITEM(l,i,v) ((l)->items[i]=(PObject*)(v))
+#define INTEGER_VALUE(o) ((o)->value)
+
+static inline int parse_py_args(const char *fmt, int nargs, PObject **args, ...){ (void)fmt; (void)nargs; (void)args; return -1; }
+static inline PList *plist_new(int n, PObject **items){ (void)n; (void)items; return 0; }
+static inline PObject *pinteger_new(int64_t v){ (void)v; return 0; }
+static inline PString *pstring_new(int n, uint8_t *buf){ (void)n; (void)buf; return 0; }
+static inline PBytes *pbytes_new(int n, uint8_t *buf){ (void)n; (void)buf; return 0; }
+static inline PBytes *pbytearray_new(int n, uint8_t *buf){ (void)n; (void)buf; return 0; }
+static inline PDict *pdict_new(int n){ (void)n; return 0; }
+static inline int pdict_put(PDict *d, PObject *k, PObject *v){ (void)d; (void)k; (void)v; return 0; }
+
+#endif
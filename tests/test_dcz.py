@@ -0,0 +1,228 @@
+"""
+DCZ operations run on the host through dczhost, on a RamFlash.
+"""
+import io
+
+import pytest
+
+from conftest import MAPPING, resource
+from dcz_delta import make_delta
+
+
+def reopen(dcz,flash,**kwargs):
+    # a new DCZ instance on the same flash, as after a reboot
+    return dcz.DCZ(MAPPING,flash=flash,**kwargs)
+
+
+def test_save_load(dcz,make):
+    flash, dc = make([resource("r0",0,b"first"),resource("r1",1,b"other")])
+    assert dc.latest_version==0
+    assert dc.load_resource("r0",check=True)==b"first"
+    dc.save_resource("r0",b"second",version=dc.next_version())
+    assert dc.latest_version==1
+    assert dc.load_resource("r0",check=True)==b"second"
+    dc.save_resource("r0",b"third, in place")
+    assert dc.latest_version==1
+    dc = reopen(dcz,flash)
+    assert dc.latest_version==1
+    assert dc.load_resource("r0",check=True)==b"third, in place"
+    assert dc.load_resource("r0",version=0,check=True)==b"first"
+    assert dc.verify()["latest"]==1
+
+def test_save_resources(dcz,make):
+    flash, dc = make([resource("r0",0,b"a"),resource("r1",1,b"b")])
+    dc.save_resources({"r0":b"aa","r1":b"bbb"},version=dc.next_version())
+    dc = reopen(dcz,flash)
+    assert dc.load_resources(["r0","r1"],check=True)==[b"aa",b"bbb"]
+
+def test_missing_resource(dcz,make):
+    flash, dc = make([resource("r0",0,b"a")])
+    with pytest.raises(dcz.DCZNoResourceError):
+        dc.load_resource("nope")
+
+
+@pytest.mark.parametrize("offset,data",[(0,b"Z"),(3,b"xy"),(4,b"odd"),(61,b"end")])
+def test_patch_in_place(dcz,make,offset,data):
+    orig = bytearray(range(64))
+    flash, dc = make([resource("r0",0,orig)])
+    dc.patch_resource("r0",offset,data)
+    orig[offset:offset+len(data)] = data
+    entry = dc.find_entry("r0")
+    assert entry[4]==dcz.fletcher32(orig)
+    assert reopen(dcz,flash).load_resource("r0",check=True)==orig
+
+def test_patch_new_version(dcz,make):
+    flash, dc = make([resource("r0",0,b"old!"*16)])
+    dc.save_resource("r0",b"A"*64,version=dc.next_version())
+    dc.patch_resource("r0",0,b"ZZ",version=dc.next_version())
+    assert dc.latest_version==2
+    assert reopen(dcz,flash).load_resource("r0",check=True)==b"ZZ"+b"A"*62
+
+def test_patch_out_of_range(dcz,make):
+    flash, dc = make([resource("r0",0,b"abcd")])
+    with pytest.raises(ValueError):
+        dc.patch_resource("r0",3,b"xy")
+
+
+def test_log(dcz,make):
+    flash, dc = make([resource("r0",0,b"base")],logs={"r0":1024})
+    for i in range(10):
+        dc.save_resource("r0",b"value%d" % i)
+    assert dc.latest_version==0
+    assert reopen(dcz,flash,logs={"r0":1024}).load_resource("r0",check=True)==b"value9"
+
+def test_log_torn_record(dcz,make,corrupt):
+    flash, dc = make([resource("r0",0,b"base")],logs={"r0":1024})
+    dc.save_resource("r0",b"value0")
+    dc.save_resource("r0",b"value1")
+    entry = dc.find_entry("r0")
+    slot, records, free = dc.scan_log(entry)
+    assert len(records)==2
+    # the last record was interrupted while being written
+    corrupt(flash,entry[1][entry[-1]]+records[-1][0])
+    assert reopen(dcz,flash,logs={"r0":1024}).load_resource("r0",check=True)==b"value0"
+    corrupt(flash,entry[1][entry[-1]]+records[0][0])
+    assert reopen(dcz,flash,logs={"r0":1024}).load_resource("r0",check=True)==b"base"
+
+def test_log_full(dcz,make):
+    flash, dc = make([resource("r0",0,b"base")],logs={"r0":64})
+    for i in range(10):
+        dc.save_resource("r0",b"value%d" % i)
+    # records that don't fit rewrite the slot
+    assert reopen(dcz,flash,logs={"r0":64}).load_resource("r0",check=True)==b"value9"
+
+
+def test_lz(dcz,make):
+    data = bytearray(b'{"topic": "sensors/temperature", "qos": 1}'*40)
+    flash, dc = make([resource("r0",0,b"x")])
+    dc.save_resource("r0",data,compress=True)
+    entry = dc.find_entry("r0")
+    assert entry[3]=="lz" and entry[2]<len(data)
+    assert reopen(dcz,flash).load_resource("r0",check=True)==data
+    rd = dc.open_resource("r0",chunk=16,decompress=True)
+    out = bytearray()
+    buf = bytearray(100)
+    n = rd.readinto(buf)
+    while n:
+        out+=buf[:n]
+        n = rd.readinto(buf)
+    assert rd.format=="bin" and out==data
+    fmt, raw = dcz.lz_decompress(dcz.lz_compress(data,"json"))
+    assert fmt=="json" and raw==data
+    assert dcz.lz_compress(b"abcdefghijkl") is None
+    with pytest.raises(ValueError):
+        dcz.lz_decompress(dcz.lz_compress(data)[:-4])
+
+def test_kv(dcz,make):
+    obj = {"name":"device","port":8883,"neg":-(1<<31),"long":"L"*2000}
+    buf = dcz.kv_dumps(obj)
+    assert dcz.kv_loads(buf)==obj
+    with pytest.raises(ValueError):
+        dcz.kv_dumps({"big":1<<31})
+    with pytest.raises(ValueError):
+        dcz.kv_loads(buf[:-1])
+    flash, dc = make([resource("r0",0,buf,"kv")])
+    assert dc.load_resource("r0")==obj
+    for key in obj:
+        assert dc.load_key("r0",key)==obj[key]
+    with pytest.raises(KeyError):
+        dc.load_key("r0","missing")
+    dc.save_resource("r0",{"port":1},format="kv",compress=True)
+    assert dc.load_key("r0","port")==1
+
+
+def test_apply_delta(dcz,make):
+    old = {"r0":bytearray(b"0123456789"*20),"r1":bytearray(b"same"),"r2":bytearray(b"gone")}
+    flash, dc = make([resource(name,i,old[name]) for i, name in enumerate(["r0","r1","r2"])])
+    new = {"r0":bytearray(old["r0"]),"r1":old["r1"],"r2":bytearray(b"replaced")}
+    new["r0"][50:53] = b"abc"
+    delta = make_delta(old,new)
+    dc.apply_delta(io.BytesIO(delta))
+    dc = reopen(dcz,flash)
+    assert dc.latest_version==1
+    for name in new:
+        assert dc.load_resource(name,check=True)==new[name]
+    # byte ranges made against other data
+    other = bytearray(old["r0"])
+    other[0] = 0x21
+    with pytest.raises(ValueError):
+        dc.apply_delta(io.BytesIO(make_delta(old,{"r0":other})))
+
+
+def test_fallback(dcz,make,corrupt):
+    flash, dc = make([resource("r0",0,b"intact data")])
+    dc.save_resource("r0",b"newer data",version=dc.next_version())
+    entry = dc.find_entry("r0")
+    corrupt(flash,entry[1][entry[-1]])
+    with pytest.raises(dcz.DCZChecksumError):
+        dc.load_resource("r0",check=True)
+    fallbacks = []
+    dc = reopen(dcz,flash,recover=True,on_fallback=lambda *args: fallbacks.append(args))
+    assert dc.load_resource("r0",check=True)==b"intact data"
+    assert fallbacks==[("r0",1,0)]
+
+def test_repair(dcz,make,corrupt):
+    flash, dc = make([resource("r0",0,b"same in both")],recover=True,repair=True)
+    entry = dc.find_entry("r0")
+    corrupt(flash,entry[1][entry[-1]])
+    assert dc.load_resource("r0",check=True)==b"same in both"
+    # without threadsafe the repair is done before returning
+    assert reopen(dcz,flash).load_resource("r0",check=True)==b"same in both"
+
+def test_repair_after_save(dcz,make,corrupt,monkeypatch):
+    pending = []
+    monkeypatch.setattr(dcz,"thread",lambda fn,*args,**kwargs: pending.append([fn,args]))
+    flash, dc = make([resource("r0",0,b"same in both")],recover=True,repair=True,threadsafe=True)
+    entry = dc.find_entry("r0")
+    corrupt(flash,entry[1][entry[-1]])
+    assert dc.load_resource("r0",check=True)==b"same in both"
+    dc.save_resource("r0",b"saved before the repair")
+    fn, args = pending.pop()
+    fn(*args)
+    assert reopen(dcz,flash).load_resource("r0",check=True)==b"saved before the repair"
+
+
+def test_cache(dcz,make):
+    flash, dc = make([resource("r0",0,b"zero"),resource("r1",1,b"one"),resource("r2",2,b"two")],cache=2)
+    assert dc.load_resource("r0")==b"zero"
+    assert dc.load_resource("r0")==b"zero"
+    hits, misses, n, size = dc.cache_stats()
+    assert hits==1 and n==1 and size==4
+    # saving drops the stale object
+    dc.save_resource("r0",b"ZERO")
+    assert dc.load_resource("r0")==b"ZERO"
+    # least recently used evicted
+    dc.load_resource("r1")
+    dc.load_resource("r2")
+    assert dc.cache_stats()[2]==2
+    hits = dc.cache_stats()[0]
+    dc.load_resource("r0")
+    assert dc.cache_stats()[0]==hits
+
+
+class Trickle():
+    # a stream returning at most one byte at a time
+    def __init__(self,data):
+        self.data = data
+        self.pos = 0
+
+    def readinto(self,buf):
+        if self.pos>=len(self.data) or not len(buf):
+            return 0
+        buf[0] = self.data[self.pos]
+        self.pos+=1
+        return 1
+
+def test_lz_reader_short_reads(dcz):
+    data = bytearray(b"short reads, short reads, short reads"*10)
+    rd = dcz.LZReader(Trickle(dcz.lz_compress(data,"str")),chunk=32)
+    assert rd.format=="str" and rd.size==len(data)
+    out = bytearray()
+    buf = bytearray(64)
+    n = rd.readinto(buf)
+    while n:
+        out+=buf[:n]
+        n = rd.readinto(buf)
+    assert out==data
+    with pytest.raises(ValueError):
+        dcz.LZReader(Trickle(dcz.lz_compress(data)[:5]))
@@ -0,0 +1,48 @@
+"""
+Host storage backends.
+"""
+from conftest import MAPPING, resource
+
+from dczhost.flash import MmapFlash
+
+
+def test_write_erases_sectors():
+    flash = MmapFlash(base=0x310000,size=0x3000,sector=0x1000)
+    flash.program(0x310000,b"\x00"*0x3000)
+    flash.write(0x311010,b"ab")
+    mem = bytes(flash.mem)
+    assert mem[0x1010:0x1012]==b"ab"
+    assert mem[0x1000:0x2000].count(b"\xff")==0x1000-2
+    assert mem[:0x1000]==b"\x00"*0x1000 and mem[0x2000:]==b"\x00"*0x1000
+
+def test_write_unaligned_base():
+    # sectors are aligned on the addresses, not on base
+    flash = MmapFlash(base=0x310800,size=0x3000,sector=0x1000)
+    flash.program(0x310800,b"\x00"*0x3000)
+    flash.write(0x311010,b"ab")
+    mem = bytes(flash.mem)
+    assert mem[:0x800]==b"\x00"*0x800
+    assert mem[0x800:0x1800].count(b"\xff")==0x1000-2
+    assert mem[0x1800:]==b"\x00"*0x1800
+    # partial sectors at the edges of the map
+    flash.write(0x310900,b"z")
+    assert bytes(flash.mem)[:0x800].count(b"\xff")==0x800-1
+
+def test_program():
+    flash = MmapFlash(base=0,size=16)
+    flash.program(0,b"\x0f\xf0")
+    flash.program(0,b"\xf3\xff")
+    assert bytes(flash.mem[:3])==b"\x03\xf0\xff"
+
+def test_dcz_on_file(dcz,tmp_path):
+    path = tmp_path/"dump.bin"
+    path.write_bytes(b"\xff"*0x10000)
+    with MmapFlash(str(path),base=0x310000) as flash:
+        dcz.format_dcz(flash,MAPPING,[resource("r0",0,b"on file")])
+        dc = dcz.DCZ(MAPPING,flash=flash)
+        dc.save_resource("r0",b"saved",version=dc.next_version())
+        dc = None
+    with MmapFlash(str(path),base=0x310000,readonly=True) as flash:
+        dc = dcz.DCZ(MAPPING,flash=flash)
+        assert dc.latest_version==1 and dc.load_resource("r0",check=True)==b"saved"
+        dc = None
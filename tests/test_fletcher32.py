@@ -0,0 +1,89 @@
+"""
+Golden vectors for the fletcher32 checksum of csrc/dcz.c, checked against the original implementation
+that reduced the sums modulo 0xffff at every word.
+
+csrc/dcz.c is built with gcc as a shared library against tests/stub/zerynth.h; the C tests are skipped if gcc is missing.
+The pure Python natives of host/dczhost are checked against the same vectors.
+"""
+import ctypes
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(ROOT,"host"))
+
+from dczhost import natives
+
+# words accumulated by csrc/dcz.c between two reductions
+BLOCK = 359
+
+
+def reference(buf):
+    # the original loop of csrc/dcz.c, with 16 bit sums reduced at every word
+    sum1 = 0
+    sum2 = 0
+    sz = len(buf)-(len(buf)&1)
+    for i in range(0,sz,2):
+        e = buf[i]|(buf[i+1]<<8)
+        sum1 = (sum1+e)%0xffff
+        sum2 = (sum1+sum2)%0xffff
+    if sz!=len(buf):
+        sum1 = (sum1+buf[sz])%0xffff
+        sum2 = (sum1+sum2)%0xffff
+    return (sum2<<16)|sum1
+
+def vectors():
+    rnd = random.Random(359)
+    lengths = list(range(0,33))
+    for k in (1,2,3,7,12):
+        n = 2*BLOCK*k
+        lengths.extend([n-3,n-2,n-1,n,n+1,n+2,n+3])
+    lengths.extend([4095,4096,4097,65535,65536])
+    res = []
+    for n in lengths:
+        # all 0xff bytes give the largest sums: the worst case for the deferred reduction
+        res.append(bytes([0xff])*n)
+        res.append(bytes(rnd.getrandbits(8) for i in range(n)))
+    return res
+
+VECTORS = vectors()
+
+GOLDEN = [
+    (b"abcde",0xf04fc729),
+    (b"abcdef",0x56502d2a),
+    (b"abcdefgh",0xebe19591),
+]
+
+
+@pytest.fixture(scope="module")
+def lib(tmp_path_factory):
+    gcc = shutil.which("gcc")
+    if gcc is None:
+        pytest.skip("gcc is needed to build csrc/dcz.c")
+    so = str(tmp_path_factory.mktemp("dcz")/"dcz.so")
+    subprocess.check_call([gcc,"-O2","-shared","-fPIC","-I",os.path.join(ROOT,"tests","stub"),
+                           "-o",so,os.path.join(ROOT,"csrc","dcz.c")])
+    lib = ctypes.CDLL(so)
+    lib._fletcher32.restype = ctypes.c_uint32
+    lib._fletcher32.argtypes = [ctypes.c_char_p,ctypes.c_uint32]
+    return lib
+
+
+@pytest.mark.parametrize("data,chk",GOLDEN)
+def test_golden(lib,data,chk):
+    assert reference(data)==chk
+    assert lib._fletcher32(data,len(data))==chk
+    assert natives.fletcher32(data)==chk
+
+def test_c_matches_reference(lib):
+    for data in VECTORS:
+        assert lib._fletcher32(data,len(data))==reference(data), len(data)
+
+def test_host_matches_reference():
+    for data in VECTORS:
+        assert natives.fletcher32(data)==reference(data), len(data)
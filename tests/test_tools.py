@@ -0,0 +1,36 @@
+"""
+Host tools working on flash images.
+"""
+import pytest
+
+from conftest import MAPPING, resource
+
+from dcz_delta import read_state
+from dczhost.flash import MmapFlash
+
+
+def image(dcz,path,corrupt=()):
+    # an image with version 0 and 1 of r0, with the tables of the zones in corrupt damaged
+    path.write_bytes(b"\xff"*0x10000)
+    with MmapFlash(str(path),base=0x310000) as flash:
+        dcz.format_dcz(flash,MAPPING,[resource("r0",0,b"version 0")])
+        dc = dcz.DCZ(MAPPING,flash=flash)
+        dc.save_resource("r0",b"version 1",version=dc.next_version())
+        dc = None
+        for zone in corrupt:
+            # the checksum of the table
+            flash.mem[MAPPING[zone]-0x310000]^=0xff
+    return str(path)
+
+def test_read_state(dcz,tmp_path):
+    resources, formats = read_state(image(dcz,tmp_path/"img.bin"),MAPPING,0x310000)
+    assert resources=={"r0":b"version 1"} and formats=={"r0":"bin"}
+
+def test_read_state_invalid_latest(dcz,tmp_path):
+    # the table with the highest version is damaged: the previous one is used
+    resources, formats = read_state(image(dcz,tmp_path/"img.bin",[1]),MAPPING,0x310000)
+    assert resources=={"r0":b"version 0"}
+
+def test_read_state_no_valid(dcz,tmp_path):
+    with pytest.raises(ValueError):
+        read_state(image(dcz,tmp_path/"img.bin",[0,1]),MAPPING,0x310000)